@@ -1,15 +1,13 @@
 import collections
 import datetime
 import time
-import requests
 import threading
-import base64
-import hashlib
-import hmac
-import json
-import pytz
 from typing import List, Tuple, Union
 
+# requests, pytz, json and the hashing modules are imported on first use rather
+# than here, so that importing this package is fast enough for short-lived
+# scripts (see crypto_facilities.cli) that may only ever make a couple of calls.
+
 # API calls are limited to 1 call every 0.1 seconds per IP address. If the API limit is
 # exceeded, the API will return error equal to apiLimitExeeded.
 
@@ -19,13 +17,15 @@ API_VERSION = '/api/v3/'
 
 def parse_time(s: str) -> datetime.datetime:
     # e.g. 2016-02-25T09:45:53.818Z
+    import pytz
     t = datetime.datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%fZ')
     return pytz.UTC.localize(t)
 
 def format_time(t: datetime.datetime) -> str:
+    import pytz
     t = t.astimezone(pytz.UTC) if t.tzinfo else t
     millisecond = t.microsecond // 1000
-    return t.strftime('%Y-%m-%dT%H:%M:%S.') + '{0:3}'.format(millisecond) + 'Z'
+    return t.strftime('%Y-%m-%dT%H:%M:%S.') + '{0:03}'.format(millisecond) + 'Z'
 
 last_nonce_lock = threading.Lock()
 last_nonce = None
@@ -57,6 +57,7 @@ def make_request(path, data=[], method='GET', key=None):
             'Authent': get_auth_ent(post_data, nonce, API_VERSION + path, key.private),
         }
 
+    import requests
     url = BASE_URL + API_VERSION + path
     
     if method == 'GET':
@@ -76,6 +77,8 @@ def make_request(path, data=[], method='GET', key=None):
 
 
 def get_auth_ent(post_data, nonce, endpoint, private_key):
+    import base64, hashlib, hmac
+
     message = post_data + nonce + endpoint
 
     sha256_hash = hashlib.sha256()
@@ -323,6 +326,7 @@ def send_or_cancel_orders(key: APIKey, instructions: List[Union[str, Tuple[Order
             instruction_struct['order_tag'] = str(i)
         instruction_structs.append(instruction_struct)
 
+    import json
     result = make_request('batchorder', data=[('json', json.dumps({'batchOrder': instruction_structs}))], method='POST', key=key)['batchStatus']
     
     statuses = [None] * len(instruction_structs)
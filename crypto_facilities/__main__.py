@@ -0,0 +1,5 @@
+import sys
+
+from crypto_facilities.cli import main
+
+sys.exit(main())
@@ -0,0 +1,188 @@
+import collections
+import datetime
+from typing import Dict, Iterable, List, Sequence
+
+from crypto_facilities import Trade
+
+# start is the (UTC) beginning of the interval, and interval is its length in seconds
+Bar = collections.namedtuple('Bar', 'start interval open high low close volume trade_count')
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+def _to_seconds(t: datetime.datetime) -> float:
+    return (t - _EPOCH).total_seconds()
+
+def _from_seconds(s: float) -> datetime.datetime:
+    return _EPOCH + datetime.timedelta(seconds=s)
+
+def _bucket_start(seconds: float, interval: int) -> int:
+    return int(seconds // interval) * interval
+
+def _check_intervals(intervals: Sequence[int]) -> List[int]:
+    intervals = sorted(set(intervals))
+    if not intervals or intervals[0] <= 0 or any(int(i) != i for i in intervals):
+        raise ValueError('Intervals must be positive whole numbers of seconds: ' + repr(intervals))
+    return [int(i) for i in intervals]
+
+def _reduce(np, starts, opens, highs, lows, closes, volumes, counts, interval):
+    buckets = (starts // interval) * interval
+    first = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    last = np.concatenate((first[1:], [len(buckets)])) - 1
+    return (
+        buckets[first],
+        opens[first],
+        np.maximum.reduceat(highs, first),
+        np.minimum.reduceat(lows, first),
+        closes[last],
+        np.add.reduceat(volumes, first),
+        np.add.reduceat(counts, first),
+    )
+
+# Batch path for backfilling: turns any number of get_trade_history() pages
+# (in any order, possibly overlapping) into a list of bars for each interval.
+#
+# Trades are deduplicated by trade_id and sorted once. The finest interval is
+# built from the trades, and each coarser interval is then built from the
+# finest interval that divides it rather than from the trades again. Only
+# intervals that contain at least one trade produce a bar.
+#
+# Requires NumPy.
+def bars_from_trades(trades: Iterable[Trade], intervals: Sequence[int]) -> Dict[int, List[Bar]]:
+    import numpy as np
+
+    intervals = _check_intervals(intervals)
+
+    by_id = {}
+    for trade in trades:
+        by_id[trade.trade_id] = trade
+    if not by_id:
+        return {interval: [] for interval in intervals}
+
+    # Trades within the same millisecond are ordered by trade_id, compared just as
+    # BarBuilder.add_many compares them. IDs needn't be integers (the WebSocket
+    # feed uses UUID strings), so rank them in Python and sort on the rank.
+    unique = [by_id[trade_id] for trade_id in sorted(by_id)]
+    times = np.fromiter((_to_seconds(t.time) for t in unique), dtype=np.float64, count=len(unique))
+    prices = np.fromiter((t.price for t in unique), dtype=np.float64, count=len(unique))
+    # Sizes can be fractional for some contracts
+    sizes = np.fromiter((t.size for t in unique), dtype=np.float64, count=len(unique))
+
+    order = np.argsort(times, kind='stable')
+    times, prices, sizes = times[order], prices[order], sizes[order]
+
+    raw = (np.floor(times), prices, prices, prices, prices, sizes, np.ones(len(times), dtype=np.int64))
+    built = {} # type: Dict[int, tuple]
+    for interval in intervals:
+        divisors = [i for i in built if interval % i == 0]
+        source = built[max(divisors)] if divisors else raw
+        built[interval] = _reduce(np, *source, interval)
+
+    result = {}
+    for interval, (starts, opens, highs, lows, closes, volumes, counts) in built.items():
+        result[interval] = [
+            Bar(_from_seconds(start), interval, o, h, l, c, v, n)
+            for start, o, h, l, c, v, n in zip(starts.tolist(), opens.tolist(), highs.tolist(), lows.tolist(), closes.tolist(), volumes.tolist(), counts.tolist())
+        ]
+
+    return result
+
+class _OpenBar(object):
+    __slots__ = ('start', 'open', 'high', 'low', 'close', 'volume', 'trade_count', 'first', 'last')
+
+    # key is the trade's (time, trade_id), which is the order bars_from_trades sorts by
+    def __init__(self, start: int, key: tuple, price: float, size: float):
+        self.start = start
+        self.open = self.high = self.low = self.close = price
+        self.volume = size
+        self.trade_count = 1
+        self.first = self.last = key
+
+    # Trades within the bar may arrive in any order
+    def add(self, key: tuple, price: float, size: float):
+        if price > self.high:
+            self.high = price
+        if price < self.low:
+            self.low = price
+        if key < self.first:
+            self.first = key
+            self.open = price
+        if key > self.last:
+            self.last = key
+            self.close = price
+        self.volume += size
+        self.trade_count += 1
+
+    def to_bar(self, interval: int) -> Bar:
+        return Bar(_from_seconds(self.start), interval, self.open, self.high, self.low, self.close, self.volume, self.trade_count)
+
+# Streaming path: feed trades in as they arrive and get back each bar as soon
+# as a later trade shows that it has closed. Each trade is looked at once and
+# updates the open bar of every interval.
+#
+# Trades that have already been seen (by trade_id) are ignored, so it is fine
+# to feed in overlapping get_trade_history() pages. Trades that are older than
+# the currently open bar of any interval can no longer be incorporated (when the
+# intervals don't divide each other, that need not be the finest one), and are
+# counted in stale_trades rather than applied. Only the IDs of trades in the open
+# bar of the finest interval are remembered, so stale_trades also counts repeats
+# of trades that have already been folded into a closed bar.
+class BarBuilder(object):
+    def __init__(self, intervals: Sequence[int]):
+        self.intervals = _check_intervals(intervals)
+        self.stale_trades = 0
+        self._open = {} # type: Dict[int, _OpenBar]
+        # interval -> earliest bar start (in seconds since the epoch) that can still be updated
+        self._floors = {} # type: Dict[int, int]
+        # trade_id -> time for trades in the currently open bar of the finest interval
+        self._seen = {} # type: Dict[int, float]
+
+    # Returns the bars which were closed by this trade, finest interval first
+    def add(self, trade: Trade) -> List[Bar]:
+        if trade.trade_id in self._seen:
+            return []
+
+        seconds = _to_seconds(trade.time)
+        # Check every interval before touching any bar, so a stale trade changes nothing
+        starts = [_bucket_start(seconds, interval) for interval in self.intervals]
+        floors = self._floors
+        if floors and any(start < floors[interval] for interval, start in zip(self.intervals, starts)):
+            self.stale_trades += 1
+            return []
+
+        key = (seconds, trade.trade_id)
+        closed = []
+        for interval, start in zip(self.intervals, starts):
+            bar = self._open.get(interval)
+            if bar is not None and bar.start == start:
+                bar.add(key, trade.price, trade.size)
+            else:
+                if bar is not None:
+                    closed.append(bar.to_bar(interval))
+                self._open[interval] = _OpenBar(start, key, trade.price, trade.size)
+                floors[interval] = start
+                if interval == self.intervals[0]:
+                    # The finest bar rolled over, so only trades in the new one need remembering
+                    self._seen = {i: t for i, t in self._seen.items() if t >= start}
+        self._seen[trade.trade_id] = seconds
+
+        return closed
+
+    # For a page of get_trade_history(), which comes back newest first
+    def add_many(self, trades: Iterable[Trade]) -> List[Bar]:
+        closed = []
+        for trade in sorted(trades, key=lambda t: (t.time, t.trade_id)):
+            closed.extend(self.add(trade))
+        return closed
+
+    # The bars which are still open, keyed by interval. They may change if more trades arrive.
+    def open_bars(self) -> Dict[int, Bar]:
+        return {interval: bar.to_bar(interval) for interval, bar in self._open.items()}
+
+    # Closes and returns all the open bars, e.g. at the end of a backfill
+    def flush(self) -> List[Bar]:
+        closed = [self._open[interval].to_bar(interval) for interval in self.intervals if interval in self._open]
+        for interval, bar in self._open.items():
+            self._floors[interval] = bar.start + interval
+        self._open.clear()
+        self._seen.clear()
+        return closed
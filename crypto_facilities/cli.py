@@ -0,0 +1,173 @@
+import argparse
+import datetime
+import os
+import sys
+from typing import Callable, Iterable, Iterator, List
+
+import crypto_facilities
+
+# A small command line tool for dumping data from the API as NDJSON (one JSON
+# object per line), e.g.
+#
+#   crypto-facilities tickers
+#   crypto-facilities orderbook fi_xbtusd_180615
+#   crypto-facilities trades fi_xbtusd_180615 --since 2018-03-01
+#   crypto-facilities fills --since 2018-03-01T12:00:00Z --key-file read_write.key
+#
+# Records are written out as each page arrives, and history is paged through
+# without being accumulated, so dumping a long history runs in constant memory.
+
+KEY_FILE_ENVIRONMENT_VARIABLE = 'CRYPTO_FACILITIES_KEY_FILE'
+
+# Most records the history endpoints return at once
+HISTORY_PAGE_SIZE = 100
+
+def _parse_since(s: str) -> datetime.datetime:
+    if s.endswith('Z'):
+        s = s[:-1] + '+00:00'
+    try:
+        t = datetime.datetime.fromisoformat(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Not an ISO 8601 time: ' + s)
+    return t.replace(tzinfo=datetime.timezone.utc) if t.tzinfo is None else t
+
+# Same format as the file the tests use: public key on the first line, private key on the second
+def _read_key(path: str) -> crypto_facilities.APIKey:
+    if path is None:
+        path = os.environ.get(KEY_FILE_ENVIRONMENT_VARIABLE)
+    if path is None:
+        raise SystemExit('This command needs an API key: pass --key-file or set ' + KEY_FILE_ENVIRONMENT_VARIABLE)
+
+    with open(path, 'r') as f:
+        public, private = [x.strip() for x in f if x.strip()]
+    return crypto_facilities.APIKey(public, private)
+
+def _to_json(x):
+    if isinstance(x, datetime.datetime):
+        return crypto_facilities.format_time(x)
+    elif hasattr(x, '_asdict'):
+        return {k: _to_json(v) for k, v in x._asdict().items()}
+    elif isinstance(x, dict):
+        return {k: _to_json(v) for k, v in x.items()}
+    elif isinstance(x, (list, tuple)):
+        return [_to_json(v) for v in x]
+    else:
+        return x
+
+def _write_page(records: Iterable, out):
+    import json
+    for record in records:
+        out.write(json.dumps(_to_json(record), separators=(',', ':')))
+        out.write('\n')
+    out.flush()
+
+# The history endpoints return at most HISTORY_PAGE_SIZE records, newest
+# first, at or before a given time. To go further back we ask again from the
+# oldest time we have seen, skipping the records at exactly that time which we
+# have already emitted. Stops once a page takes us back past since, or we reach
+# the start of the history. If more than a page's worth of records share one
+# time we can't get past them, and exit with an error rather than silently
+# stopping short.
+def _history_pages(fetch: Callable[[datetime.datetime], List], get_time: Callable, get_id: Callable,
+                   since: datetime.datetime) -> Iterator[List]:
+    last_time = None
+    boundary_ids = set()
+    while True:
+        page = fetch(last_time)
+        fresh = [r for r in page if get_id(r) not in boundary_ids]
+        in_range = [r for r in fresh if get_time(r) >= since]
+        if in_range:
+            yield in_range
+        if not fresh:
+            # A short page of records we've already seen is just the start of the history
+            if len(page) >= HISTORY_PAGE_SIZE and min(get_time(r) for r in page) >= since:
+                raise SystemExit('History is incomplete: more records at {} than fit in one page'.format(
+                    crypto_facilities.format_time(last_time)))
+            return
+        if len(in_range) < len(fresh):
+            return
+
+        last_time = min(get_time(r) for r in fresh)
+        boundary_ids = {get_id(r) for r in page if get_time(r) == last_time}
+
+def _dump_history(args, fetch, get_time, get_id, out):
+    if args.since is None:
+        _write_page(fetch(None), out)
+    else:
+        for page in _history_pages(fetch, get_time, get_id, args.since):
+            _write_page(page, out)
+
+def _instruments(args, out):
+    _write_page(crypto_facilities.get_instruments(), out)
+
+def _tickers(args, out):
+    tickers = crypto_facilities.get_tickers()
+    if args.symbols:
+        symbols = set(args.symbols)
+        tickers = [t for t in tickers if t['symbol'] in symbols]
+    _write_page(tickers, out)
+
+def _orderbook(args, out):
+    _write_page([crypto_facilities.get_order_book(args.symbol)], out)
+
+def _trades(args, out):
+    _dump_history(args,
+        lambda last_time: crypto_facilities.get_trade_history(args.symbol, last_time=last_time),
+        lambda trade: trade.time, lambda trade: trade.trade_id, out)
+
+def _fills(args, out):
+    key = _read_key(args.key_file)
+    _dump_history(args,
+        lambda last_time: crypto_facilities.get_fill_history(key, last_time=last_time),
+        lambda fill: fill['fillTime'], lambda fill: fill['fill_id'], out)
+
+def _positions(args, out):
+    _write_page(crypto_facilities.get_positions(_read_key(args.key_file)), out)
+
+def _open_orders(args, out):
+    _write_page(crypto_facilities.get_open_orders(_read_key(args.key_file)), out)
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='crypto-facilities', description='Dump Crypto Facilities API data as NDJSON')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    def add_command(name, handler, help, authenticated=False):
+        command = commands.add_parser(name, help=help)
+        command.set_defaults(handler=handler)
+        if authenticated:
+            command.add_argument('--key-file', help='File containing the public and private API keys, one per line (default: $' + KEY_FILE_ENVIRONMENT_VARIABLE + ')')
+        return command
+
+    add_command('instruments', _instruments, 'All instruments')
+
+    command = add_command('tickers', _tickers, 'Tickers for all (or the given) symbols')
+    command.add_argument('symbols', nargs='*', metavar='SYMBOL')
+
+    command = add_command('orderbook', _orderbook, 'Order book for a symbol')
+    command.add_argument('symbol', metavar='SYMBOL')
+
+    command = add_command('trades', _trades, 'Recent trades for a symbol, newest first')
+    command.add_argument('symbol', metavar='SYMBOL')
+    command.add_argument('--since', type=_parse_since, help='Page back through history to this time rather than just fetching the latest page')
+
+    command = add_command('fills', _fills, 'Your fills, newest first', authenticated=True)
+    command.add_argument('--since', type=_parse_since, help='Page back through history to this time rather than just fetching the latest page')
+
+    add_command('positions', _positions, 'Your open positions', authenticated=True)
+    add_command('openorders', _open_orders, 'Your open orders', authenticated=True)
+
+    return parser
+
+def main(argv: List[str] = None, out=None) -> int:
+    args = make_parser().parse_args(argv)
+    out = sys.stdout if out is None else out
+    try:
+        args.handler(args, out)
+    except BrokenPipeError:
+        # e.g. piped into head: stop quietly, and stop Python complaining when it flushes stdout at exit
+        sys.stdout = None
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
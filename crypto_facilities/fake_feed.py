@@ -0,0 +1,470 @@
+import base64
+import collections
+import hashlib
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+import uuid
+from typing import Dict, List
+
+from crypto_facilities import APIKey
+from crypto_facilities.feed import sign_challenge
+
+# A local stand-in for the exchange's WebSocket feed server, so that
+# crypto_facilities.feed can be tested and benchmarked without a network
+# connection. It speaks just enough of RFC 6455 to talk to websocket-client,
+# and just enough of the feed protocol (subscriptions, challenges, heartbeats,
+# snapshots followed by sequenced deltas) to exercise the client.
+#
+# Market data is whatever you publish via the methods below, e.g.
+#
+#   with FakeFeedServer() as server:
+#       server.set_book('pi_xbtusd', bids=[[4000, 10]], asks=[[4001, 5]])
+#       client = FeedClient(server.url)
+#       ...
+#       server.update_book('pi_xbtusd', 'buy', 4000, 20)
+#
+# Symbols may be given in either case; as on the real feed, product IDs are sent
+# in upper case.
+
+_WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+_OPCODE_TEXT = 0x1
+_OPCODE_CLOSE = 0x8
+_OPCODE_PING = 0x9
+_OPCODE_PONG = 0xA
+
+# How many recent trades/fills are replayed in a snapshot
+SNAPSHOT_LENGTH = 100
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+def _read_exact(f, n: int) -> bytes:
+    data = f.read(n)
+    if len(data) != n:
+        raise ConnectionError('Connection closed')
+    return data
+
+def _read_frame(f):
+    b0, b1 = _read_exact(f, 2)
+    opcode = b0 & 0x0F
+    length = b1 & 0x7F
+    if length == 126:
+        length, = struct.unpack('!H', _read_exact(f, 2))
+    elif length == 127:
+        length, = struct.unpack('!Q', _read_exact(f, 8))
+
+    mask = _read_exact(f, 4) if b1 & 0x80 else None
+    payload = _read_exact(f, length)
+    if mask is not None and length:
+        mask = (mask * (length // 4 + 1))[:length]
+        payload = (int.from_bytes(payload, 'big') ^ int.from_bytes(mask, 'big')).to_bytes(length, 'big')
+
+    return opcode, payload
+
+def _encode_frame(opcode: int, payload: bytes) -> bytes:
+    # Servers never mask, and we never fragment
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < (1 << 16):
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+class _Connection(object):
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.subscriptions = {} # feed -> set of product IDs
+        self.challenge = None
+
+    def send(self, message: dict):
+        frame = _encode_frame(_OPCODE_TEXT, json.dumps(message).encode('utf8'))
+        try:
+            with self.lock:
+                self.sock.sendall(frame)
+        except OSError:
+            pass
+
+    def send_frame(self, opcode: int, payload: bytes):
+        with self.lock:
+            self.sock.sendall(_encode_frame(opcode, payload))
+
+    def subscribed(self, feed: str, product_id: str = None) -> bool:
+        products = self.subscriptions.get(feed)
+        return products is not None and (product_id is None or product_id in products)
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        fake = self.server.fake
+        if not self._handshake():
+            return
+
+        connection = _Connection(self.request)
+        with fake._lock:
+            fake._connections.append(connection)
+        try:
+            connection.send({'event': 'info', 'version': 1})
+            while True:
+                opcode, payload = _read_frame(self.rfile)
+                if opcode == _OPCODE_TEXT:
+                    fake._handle(connection, json.loads(payload.decode('utf8')))
+                elif opcode == _OPCODE_PING:
+                    connection.send_frame(_OPCODE_PONG, payload)
+                elif opcode == _OPCODE_CLOSE:
+                    connection.send_frame(_OPCODE_CLOSE, payload[:2])
+                    break
+        except (OSError, ValueError):
+            pass
+        finally:
+            with fake._lock:
+                if connection in fake._connections:
+                    fake._connections.remove(connection)
+
+    def _handshake(self) -> bool:
+        headers = {}
+        self.rfile.readline() # GET /ws/v1 HTTP/1.1
+        while True:
+            line = self.rfile.readline().decode('latin1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        key = headers.get('sec-websocket-key')
+        if key is None:
+            self.wfile.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            return False
+
+        accept = base64.b64encode(hashlib.sha1((key + _WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+        self.wfile.write((
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Accept: ' + accept + '\r\n\r\n'
+        ).encode('ascii'))
+        return True
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _Book(object):
+    def __init__(self):
+        self.seq = 0
+        self.levels = {'buy': {}, 'sell': {}}
+
+class FakeFeedServer(object):
+    # If keys is given, private subscriptions must be signed by one of them.
+    # Otherwise any API key is accepted, and signatures are not checked.
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, keys: List[APIKey] = None, heartbeat_interval: float = 1.0):
+        self.heartbeat_interval = heartbeat_interval
+        self._keys = None if keys is None else {key.public: key for key in keys}
+
+        self._lock = threading.RLock()
+        self._connections = [] # type: List[_Connection]
+        self._tickers = {}  # type: Dict[str, dict]
+        self._books = collections.defaultdict(_Book) # type: Dict[str, _Book]
+        self._trades = collections.defaultdict(lambda: collections.deque(maxlen=SNAPSHOT_LENGTH))
+        self._trade_seqs = collections.Counter()
+        self._fills = collections.deque(maxlen=SNAPSHOT_LENGTH)
+        self._fill_seq = 0
+        self._open_orders = collections.OrderedDict()
+
+        self._server = _Server((host, port), _Handler)
+        self._server.fake = self
+        self._threads = []
+        self._stopping = threading.Event()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return 'ws://{}:{}/ws/v1'.format(host, port)
+
+    def start(self) -> 'FakeFeedServer':
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, daemon=True),
+            threading.Thread(target=self._heartbeat_loop, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._server.shutdown()
+        self.drop_connections()
+        self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self) -> 'FakeFeedServer':
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # Abruptly closes every client connection, as if the network had dropped
+    def drop_connections(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.sock.close()
+
+    def connection_count(self) -> int:
+        with self._lock:
+            return len(self._connections)
+
+    # Number of connections subscribed to the feed (and symbol, if given)
+    def subscriber_count(self, feed: str, symbol: str = None) -> int:
+        product_id = None if symbol is None else symbol.upper()
+        with self._lock:
+            return sum(1 for connection in self._connections if connection.subscribed(feed, product_id))
+
+    def _heartbeat_loop(self):
+        while not self._stopping.wait(self.heartbeat_interval or 1.0):
+            if self.heartbeat_interval:
+                self._broadcast('heartbeat', None, {'feed': 'heartbeat', 'time': _now_ms()})
+
+    # Callers must update state and broadcast in one hold of the lock, so that a
+    # new subscriber's snapshot either includes a message or is followed by it
+    def _broadcast(self, feed: str, product_id: str, message: dict):
+        with self._lock:
+            for connection in self._connections:
+                if connection.subscribed(feed, product_id):
+                    connection.send(message)
+
+    # ---- Market data ----
+
+    # fields use the names from the ticker feed, e.g. bid, bid_size, markPrice
+    def publish_ticker(self, symbol: str, **fields):
+        product_id = symbol.upper()
+        message = dict(fields, feed='ticker', product_id=product_id, time=_now_ms())
+        with self._lock:
+            self._tickers[product_id] = message
+            self._broadcast('ticker', product_id, message)
+
+    # Replaces the whole book, and sends a new snapshot to subscribers
+    def set_book(self, symbol: str, bids: List[List[float]], asks: List[List[float]]):
+        product_id = symbol.upper()
+        with self._lock:
+            book = self._books[product_id]
+            book.seq += 1
+            book.levels = {'buy': {p: q for p, q in bids}, 'sell': {p: q for p, q in asks}}
+            message = self._book_snapshot(product_id)
+            self._broadcast('book', product_id, message)
+
+    def _book_snapshot(self, product_id: str) -> dict:
+        book = self._books[product_id]
+        return {
+            'feed': 'book_snapshot',
+            'product_id': product_id,
+            'timestamp': _now_ms(),
+            'seq': book.seq,
+            'bids': [{'price': p, 'qty': q} for p, q in sorted(book.levels['buy'].items(), reverse=True)],
+            'asks': [{'price': p, 'qty': q} for p, q in sorted(book.levels['sell'].items())],
+        }
+
+    # A qty of 0 removes the level. skip_seq simulates a lost message.
+    def update_book(self, symbol: str, side: str, price: float, qty: float, skip_seq: bool = False):
+        product_id = symbol.upper()
+        with self._lock:
+            book = self._books[product_id]
+            book.seq += 2 if skip_seq else 1
+            if qty > 0:
+                book.levels[side][price] = qty
+            else:
+                book.levels[side].pop(price, None)
+            message = {
+                'feed': 'book',
+                'product_id': product_id,
+                'side': side,
+                'seq': book.seq,
+                'price': price,
+                'qty': qty,
+                'timestamp': _now_ms(),
+            }
+            self._broadcast('book', product_id, message)
+
+    def publish_trade(self, symbol: str, price: float, qty: int, side: str = 'buy', time_ms: int = None, skip_seq: bool = False) -> str:
+        product_id = symbol.upper()
+        with self._lock:
+            self._trade_seqs[product_id] += 2 if skip_seq else 1
+            # Like the real feed, trade uids are UUID strings rather than the REST API's integer trade_ids
+            uid = str(uuid.uuid4())
+            message = {
+                'feed': 'trade',
+                'product_id': product_id,
+                'uid': uid,
+                'side': side,
+                'type': 'fill',
+                'seq': self._trade_seqs[product_id],
+                'time': _now_ms() if time_ms is None else time_ms,
+                'qty': qty,
+                'price': price,
+            }
+            self._trades[product_id].append(message)
+            self._broadcast('trade', product_id, message)
+        return uid
+
+    # ---- Private feeds ----
+
+    def publish_fill(self, symbol: str, side: str, qty: int, price: float, order_id: str = None, skip_seq: bool = False) -> str:
+        with self._lock:
+            self._fill_seq += 2 if skip_seq else 1
+            fill = {
+                'instrument': symbol.upper(),
+                'time': _now_ms(),
+                'price': price,
+                'seq': self._fill_seq,
+                'buy': side == 'buy',
+                'qty': qty,
+                'order_id': order_id or str(uuid.uuid4()),
+                'fill_id': str(uuid.uuid4()),
+                'fill_type': 'maker',
+            }
+            self._fills.append(fill)
+            self._broadcast('fills', None, {'feed': 'fills', 'fills': [fill]})
+        return fill['fill_id']
+
+    def publish_open_order(self, symbol: str, side: str, qty: int, limit_price: float, filled: int = 0,
+                           stop_price: float = None, order_id: str = None) -> str:
+        with self._lock:
+            order = {
+                'instrument': symbol.upper(),
+                'time': _now_ms(),
+                'last_update_time': _now_ms(),
+                'qty': qty,
+                'filled': filled,
+                'limit_price': limit_price,
+                'stop_price': stop_price,
+                'type': 'limit' if stop_price is None else 'stop',
+                'order_id': order_id or str(uuid.uuid4()),
+                'direction': 0 if side == 'buy' else 1,
+                'reduce_only': False,
+            }
+            self._open_orders[order['order_id']] = order
+            self._broadcast('open_orders', None, {'feed': 'open_orders', 'order': order, 'is_cancel': False, 'reason': 'new_placed_order_by_user'})
+        return order['order_id']
+
+    def cancel_open_order(self, order_id: str):
+        with self._lock:
+            self._open_orders.pop(order_id)
+            self._broadcast('open_orders', None, {'feed': 'open_orders', 'order_id': order_id, 'is_cancel': True, 'reason': 'cancelled_by_user'})
+
+    # ---- Requests from clients ----
+
+    def _handle(self, connection: _Connection, message: dict):
+        event = message.get('event')
+        if event == 'challenge':
+            connection.challenge = str(uuid.uuid4())
+            connection.send({'event': 'challenge', 'message': connection.challenge})
+        elif event in ('subscribe', 'unsubscribe'):
+            feed = message.get('feed')
+            if feed in ('fills', 'open_orders') and not self._check_challenge(connection, message):
+                connection.send({'event': 'error', 'message': 'Invalid challenge'})
+                return
+
+            product_ids = message.get('product_ids') or []
+            if event == 'unsubscribe':
+                self._unsubscribe(connection, feed, product_ids)
+            else:
+                self._subscribe(connection, feed, product_ids)
+        else:
+            connection.send({'event': 'error', 'message': 'Unknown event'})
+
+    def _check_challenge(self, connection: _Connection, message: dict) -> bool:
+        if connection.challenge is None or message.get('original_challenge') != connection.challenge:
+            return False
+        if self._keys is None:
+            return True
+        key = self._keys.get(message.get('api_key'))
+        return key is not None and message.get('signed_challenge') == sign_challenge(connection.challenge, key.private)
+
+    def _unsubscribe(self, connection: _Connection, feed: str, product_ids: List[str]):
+        with self._lock:
+            products = connection.subscriptions.get(feed)
+            if products is not None:
+                if product_ids:
+                    products.difference_update(product_ids)
+                else:
+                    del connection.subscriptions[feed]
+
+        reply = {'event': 'unsubscribed', 'feed': feed}
+        if product_ids:
+            reply['product_ids'] = product_ids
+        connection.send(reply)
+
+    def _subscribe(self, connection: _Connection, feed: str, product_ids: List[str]):
+        if feed not in ('heartbeat', 'ticker', 'book', 'trade', 'fills', 'open_orders'):
+            connection.send({'event': 'error', 'message': 'Unknown feed ' + str(feed)})
+            return
+
+        reply = {'event': 'subscribed', 'feed': feed}
+        if product_ids:
+            reply['product_ids'] = product_ids
+
+        # Hold the lock while sending the snapshots, so that no delta can be
+        # broadcast between the snapshot being taken and it being sent
+        with self._lock:
+            connection.subscriptions.setdefault(feed, set()).update(product_ids)
+            connection.send(reply)
+
+            if feed == 'ticker':
+                for product_id in product_ids:
+                    if product_id in self._tickers:
+                        connection.send(self._tickers[product_id])
+            elif feed == 'book':
+                for product_id in product_ids:
+                    connection.send(self._book_snapshot(product_id))
+            elif feed == 'trade':
+                for product_id in product_ids:
+                    connection.send({'feed': 'trade_snapshot', 'product_id': product_id, 'trades': list(self._trades[product_id])})
+            elif feed == 'fills':
+                connection.send({'feed': 'fills_snapshot', 'fills': list(self._fills)})
+            elif feed == 'open_orders':
+                connection.send({'feed': 'open_orders_snapshot', 'orders': list(self._open_orders.values())})
+
+# Runs a server that publishes a random walk, for benchmarking a client against:
+#
+#   python -m crypto_facilities.fake_feed --port 8765 --rate 10000 pi_xbtusd
+def main(argv: List[str] = None):
+    import argparse
+    import random
+
+    parser = argparse.ArgumentParser(description='Local fake Crypto Facilities WebSocket feed')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rate', type=float, default=1000, help='Book updates per second, per symbol')
+    parser.add_argument('symbols', nargs='+', metavar='SYMBOL')
+    args = parser.parse_args(argv)
+
+    with FakeFeedServer(args.host, args.port) as server:
+        print('Serving on ' + server.url, flush=True)
+        mid = {symbol: 4000 for symbol in args.symbols}
+        for symbol in args.symbols:
+            server.set_book(symbol, bids=[[4000 - i, 1000] for i in range(1, 51)], asks=[[4000 + i, 1000] for i in range(1, 51)])
+
+        interval = 1.0 / args.rate
+        while True:
+            for symbol in args.symbols:
+                mid[symbol] += random.choice((-1, 0, 1))
+                side = random.choice(('buy', 'sell'))
+                price = mid[symbol] - random.randint(1, 50) if side == 'buy' else mid[symbol] + random.randint(1, 50)
+                server.update_book(symbol, side, price, random.choice((0, random.randint(1, 5000))))
+                if random.random() < 0.1:
+                    server.publish_ticker(symbol, bid=mid[symbol] - 1, ask=mid[symbol] + 1, markPrice=mid[symbol])
+            time.sleep(interval)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+import bisect
+import collections
+import datetime
+import time
+from typing import Dict, Iterator, List
+
+import crypto_facilities
+from crypto_facilities import APIKey, OrderBook, Trade, OpenOrder, OrderStatus, LimitOrderSpec, StopOrderSpec
+
+# Client for the exchange's WebSocket feeds, which push updates rather than
+# making us poll, and don't count towards the REST rate limit. Records are
+# converted to the same types that the corresponding REST functions return:
+#
+#   ticker      -> dict, as for get_tickers()
+#   book        -> OrderBook, as for get_order_book(), rebuilt locally from snapshots and deltas
+#   trade       -> Trade, as for get_trade_history()
+#   fills       -> dict, as for get_fill_history()
+#   open_orders -> OpenOrder, as for get_open_orders(), or an OrderStatus with status 'cancelled'
+#
+# Requires the websocket-client package. See crypto_facilities.fake_feed for a
+# local server that speaks the same protocol, for tests and benchmarks.
+
+FEED_URL = 'wss://www.cryptofacilities.com/ws/v1'
+
+PUBLIC_FEEDS = ('ticker', 'book', 'trade')
+PRIVATE_FEEDS = ('fills', 'open_orders')
+
+# feed is the name of the feed subscribed to, e.g. 'book', and symbol is in the
+# lower case form used by the REST API (None for fills and open orders)
+FeedEvent = collections.namedtuple('FeedEvent', 'feed symbol record')
+
+def _parse_ms(ms: int) -> datetime.datetime:
+    import pytz
+    return datetime.datetime.fromtimestamp(ms / 1000.0, pytz.UTC)
+
+def _symbol(product_id: str) -> str:
+    return product_id.lower()
+
+def _product_id(symbol: str) -> str:
+    return symbol.upper()
+
+def sign_challenge(challenge: str, private_key: str) -> str:
+    # Same scheme as the REST Authent header, but over just the challenge
+    return crypto_facilities.get_auth_ent(challenge, '', '', private_key).decode('ascii')
+
+# Field names in the ticker feed -> field names in get_tickers()
+_TICKER_FIELDS = {
+    'bid': 'bid',
+    'bid_size': 'bidSize',
+    'ask': 'ask',
+    'ask_size': 'askSize',
+    'last': 'last',
+    'lastSize': 'lastSize',
+    'volume': 'vol24h',
+    'markPrice': 'markPrice',
+    'suspended': 'suspended',
+    'open24h': 'open24h',
+    'high24h': 'high24h',
+    'low24h': 'low24h',
+}
+
+def _get_ticker(message: dict) -> dict:
+    ticker = {'symbol': _symbol(message['product_id'])}
+    for feed_field, rest_field in _TICKER_FIELDS.items():
+        if feed_field in message:
+            ticker[rest_field] = message[feed_field]
+    if 'lastTime' in message:
+        ticker['lastTime'] = crypto_facilities.parse_time(message['lastTime'])
+    return ticker
+
+def _get_trade(message: dict) -> Trade:
+    return Trade(
+        time=_parse_ms(message['time']),
+        trade_id=message['uid'],
+        price=message['price'],
+        size=message['qty'],
+    )
+
+def _get_fill(message: dict) -> dict:
+    return {
+        'fillTime': _parse_ms(message['time']),
+        'order_id': message['order_id'],
+        'fill_id': message['fill_id'],
+        'symbol': _symbol(message['instrument']),
+        'side': 'buy' if message['buy'] else 'sell',
+        'size': message['qty'],
+        'price': message['price'],
+    }
+
+def _get_open_order(order: dict) -> OpenOrder:
+    symbol = _symbol(order['instrument'])
+    side = 'buy' if order['direction'] == 0 else 'sell'
+    if order['type'] == 'limit':
+        spec = LimitOrderSpec(symbol, side, order['limit_price'])
+    elif order['type'] == 'stop':
+        spec = StopOrderSpec(symbol, side, order['limit_price'], order['stop_price'])
+    else:
+        raise ValueError('Unknown order type ' + order['type'])
+
+    filled_size = order['filled']
+    status = OrderStatus(
+        received_time=_parse_ms(order['time']),
+        status='untouched' if filled_size == 0 else 'partiallyFilled',
+        order_id=order['order_id'],
+    )
+    return OpenOrder(spec, status, filled_size, order['qty'] - filled_size)
+
+class _Side(object):
+    __slots__ = ('sizes', 'prices')
+
+    # Prices are kept sorted ascending as they change, so that a delta costs a
+    # dict update and at most one bisect, rather than a re-sort of the side
+    def __init__(self, levels: List[dict]):
+        self.sizes = {level['price']: level['qty'] for level in levels if level['qty'] > 0}
+        self.prices = sorted(self.sizes)
+
+    def apply(self, price: float, qty: float):
+        if qty > 0:
+            if price not in self.sizes:
+                bisect.insort(self.prices, price)
+            self.sizes[price] = qty
+        elif self.sizes.pop(price, None) is not None:
+            del self.prices[bisect.bisect_left(self.prices, price)]
+
+    def best_first(self, descending: bool, depth: int = None) -> List[List[float]]:
+        prices, sizes = self.prices, self.sizes
+        if descending:
+            prices = prices[::-1] if depth is None else prices[:-depth - 1:-1]
+        elif depth is not None:
+            prices = prices[:depth]
+        return [[price, sizes[price]] for price in prices]
+
+class _Book(object):
+    __slots__ = ('seq', 'bids', 'asks')
+
+    def __init__(self, message: dict):
+        self.seq = message['seq']
+        self.bids = _Side(message['bids'])
+        self.asks = _Side(message['asks'])
+
+    def apply(self, message: dict):
+        self.seq = message['seq']
+        side = self.bids if message['side'] == 'buy' else self.asks
+        side.apply(message['price'], message['qty'])
+
+    def to_order_book(self, depth: int = None) -> OrderBook:
+        return OrderBook(
+            bids=self.bids.best_first(True, depth),
+            asks=self.asks.best_first(False, depth),
+        )
+
+# Usage:
+#
+#   client = FeedClient(key=key)
+#   client.subscribe('book', ['fi_xbtusd_180615'])
+#   client.subscribe('fills')
+#   for event in client.events():
+#       ...
+#
+# The client subscribes to the heartbeat feed as well, and if nothing at all is
+# heard from the server for heartbeat_timeout seconds it reconnects. On
+# reconnection every subscription is replayed, and so fresh snapshots arrive.
+#
+# Book, trade and fill messages carry sequence numbers. If one is skipped, the
+# affected subscription is torn down and re-established so that the local book
+# is rebuilt from a new snapshot rather than silently going wrong. The number of
+# gaps seen so far is available as client.gaps. Note that the new trade and fill
+# snapshots will repeat records that have already been yielded, so dedupe on
+# trade_id/fill_id if that matters to you.
+#
+# Every book message yields a fresh OrderBook. If you only care about the top
+# of the book, pass book_depth so that building it costs O(book_depth) rather
+# than O(levels in the book).
+class FeedClient(object):
+    def __init__(self, url: str = FEED_URL, key: APIKey = None, heartbeat_timeout: float = 10.0, reconnect_delay: float = 1.0,
+                 book_depth: int = None):
+        self.url = url
+        self.key = key
+        self.heartbeat_timeout = heartbeat_timeout
+        self.reconnect_delay = reconnect_delay
+        self.book_depth = book_depth
+
+        self.gaps = 0
+        self.reconnects = 0
+
+        self._subscriptions = collections.OrderedDict() # feed -> list of product IDs, or None
+        self._ws = None
+        self._challenge = None
+        self._pending_private = [] # type: List[dict]
+        self._books = {}    # type: Dict[str, _Book]
+        self._trade_seqs = {} # type: Dict[str, int]
+        self._fill_seq = None
+        self._closed = False
+
+    def subscribe(self, feed: str, symbols: List[str] = None):
+        if feed in PUBLIC_FEEDS:
+            if not symbols:
+                raise ValueError('The ' + feed + ' feed needs at least one symbol')
+            existing = self._subscriptions.get(feed) or []
+            product_ids = [_product_id(s) for s in symbols if _product_id(s) not in existing]
+            self._subscriptions[feed] = existing + product_ids
+        elif feed in PRIVATE_FEEDS:
+            if self.key is None:
+                raise ValueError('The ' + feed + ' feed needs an API key')
+            product_ids = None
+            self._subscriptions[feed] = None
+        else:
+            raise ValueError('Unknown feed ' + feed)
+
+        if self._ws is not None:
+            import websocket
+            try:
+                self._send_subscribe(feed, product_ids)
+            except (OSError, websocket.WebSocketException):
+                # The subscription will be replayed when events() reconnects
+                pass
+
+    # May be called from another thread to stop events()
+    def close(self):
+        self._closed = True
+        self._disconnect()
+
+    def _send(self, message: dict):
+        import json
+        import websocket
+        # close() may clear self._ws from another thread at any moment
+        ws = self._ws
+        if ws is None:
+            raise websocket.WebSocketConnectionClosedException('Connection closed')
+        ws.send(json.dumps(message))
+
+    def _send_subscribe(self, feed: str, product_ids: List[str] = None, event: str = 'subscribe'):
+        message = {'event': event, 'feed': feed}
+        if product_ids is not None:
+            message['product_ids'] = product_ids
+
+        if feed in PRIVATE_FEEDS:
+            message['api_key'] = self.key.public
+            if self._challenge is None:
+                # Sent once the server has told us what to sign
+                self._pending_private.append(message)
+                if len(self._pending_private) == 1:
+                    self._send({'event': 'challenge', 'api_key': self.key.public})
+                return
+            message['original_challenge'] = self._challenge
+            message['signed_challenge'] = sign_challenge(self._challenge, self.key.private)
+
+        self._send(message)
+
+    def _resubscribe(self, feed: str, product_ids: List[str] = None):
+        self.gaps += 1
+        self._send_subscribe(feed, product_ids, event='unsubscribe')
+        self._send_subscribe(feed, product_ids)
+
+    def _connect(self):
+        import websocket
+        ws = websocket.create_connection(self.url, timeout=self.heartbeat_timeout)
+        self._ws = ws
+        if self._closed:
+            # Raced with close()
+            self._disconnect(ws)
+            return
+        self._challenge = None
+        self._pending_private = []
+        self._books.clear()
+        self._trade_seqs.clear()
+        self._fill_seq = None
+
+        self._send({'event': 'subscribe', 'feed': 'heartbeat'})
+        for feed, product_ids in self._subscriptions.items():
+            self._send_subscribe(feed, product_ids)
+
+    # Closes ws (by default the current connection), forgetting it if it is still current
+    def _disconnect(self, ws=None):
+        if ws is None:
+            ws = self._ws
+        if self._ws is ws:
+            self._ws = None
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    # Yields FeedEvents forever, reconnecting as necessary, until close() is
+    # called. It is fine to stop iterating and call events() again later: the
+    # connection stays open in the meantime.
+    def events(self) -> Iterator[FeedEvent]:
+        import json
+        import websocket
+
+        while not self._closed:
+            # Read self._ws once per iteration, since close() can clear it from another thread
+            ws = self._ws
+            if ws is None:
+                try:
+                    self._connect()
+                except (OSError, websocket.WebSocketException):
+                    self._disconnect()
+                    if not self._closed:
+                        time.sleep(self.reconnect_delay)
+                continue
+
+            try:
+                raw = ws.recv()
+                if not raw and not ws.connected:
+                    # The server sent a close frame
+                    raise websocket.WebSocketConnectionClosedException('Connection closed')
+                # Handling a message can send (un)subscriptions, which can fail in the same ways
+                events = self._handle(json.loads(raw)) if raw else []
+            except (OSError, websocket.WebSocketException):
+                # Includes timeouts, i.e. missed heartbeats
+                self._disconnect(ws)
+                if not self._closed:
+                    self.reconnects += 1
+                continue
+
+            for event in events:
+                yield event
+
+    def _handle(self, message: dict) -> List[FeedEvent]:
+        event = message.get('event')
+        if event is not None:
+            if event == 'challenge':
+                self._challenge = message['message']
+                pending, self._pending_private = self._pending_private, []
+                for subscription in pending:
+                    self._send_subscribe(subscription['feed'], subscription.get('product_ids'), subscription['event'])
+            elif event == 'error':
+                raise ValueError(message.get('message', 'unspecifiedError'))
+            # Otherwise info/subscribed/unsubscribed acknowledgements
+            return []
+
+        feed = message.get('feed')
+        if feed == 'ticker':
+            return [FeedEvent('ticker', _symbol(message['product_id']), _get_ticker(message))]
+        elif feed == 'book_snapshot':
+            symbol = _symbol(message['product_id'])
+            book = self._books[symbol] = _Book(message)
+            return [FeedEvent('book', symbol, book.to_order_book(self.book_depth))]
+        elif feed == 'book':
+            symbol = _symbol(message['product_id'])
+            book = self._books.get(symbol)
+            if book is None:
+                # Deltas racing ahead of the snapshot after a resubscribe
+                return []
+            if message['seq'] <= book.seq:
+                # Already included in the snapshot, or a repeat
+                return []
+            if message['seq'] > book.seq + 1:
+                del self._books[symbol]
+                self._resubscribe('book', [message['product_id']])
+                return []
+            book.apply(message)
+            return [FeedEvent('book', symbol, book.to_order_book(self.book_depth))]
+        elif feed == 'trade_snapshot':
+            symbol = _symbol(message['product_id'])
+            trades = sorted(message['trades'], key=lambda t: t['seq'])
+            if trades:
+                self._trade_seqs[symbol] = trades[-1]['seq']
+            return [FeedEvent('trade', symbol, _get_trade(t)) for t in trades]
+        elif feed == 'trade':
+            symbol = _symbol(message['product_id'])
+            last_seq = self._trade_seqs.get(symbol)
+            if last_seq is not None and message['seq'] <= last_seq:
+                return []
+            self._trade_seqs[symbol] = message['seq']
+            if last_seq is not None and message['seq'] > last_seq + 1:
+                del self._trade_seqs[symbol]
+                self._resubscribe('trade', [message['product_id']])
+            return [FeedEvent('trade', symbol, _get_trade(message))]
+        elif feed in ('fills_snapshot', 'fills'):
+            fills = sorted(message['fills'], key=lambda f: f['seq'])
+            if feed == 'fills' and self._fill_seq is not None:
+                # Drop fills already included in the snapshot, or repeats
+                fills = [f for f in fills if f['seq'] > self._fill_seq]
+            if feed == 'fills' and fills and self._fill_seq is not None and fills[0]['seq'] > self._fill_seq + 1:
+                self._fill_seq = None
+                self._resubscribe('fills')
+            elif fills:
+                self._fill_seq = fills[-1]['seq']
+            return [FeedEvent('fills', None, _get_fill(f)) for f in fills]
+        elif feed == 'open_orders_snapshot':
+            return [FeedEvent('open_orders', None, _get_open_order(o)) for o in message['orders']]
+        elif feed == 'open_orders':
+            if message.get('is_cancel'):
+                order_id = message['order_id'] if 'order_id' in message else message['order']['order_id']
+                return [FeedEvent('open_orders', None, OrderStatus(received_time=None, status='cancelled', order_id=order_id))]
+            return [FeedEvent('open_orders', None, _get_open_order(message['order']))]
+        else:
+            # Heartbeats, and anything we don't understand
+            return []
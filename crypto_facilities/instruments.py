@@ -0,0 +1,223 @@
+import bisect
+import collections
+import datetime
+import decimal
+import math
+import threading
+from typing import Dict, List, Optional
+
+import crypto_facilities
+
+# Tolerance (in ticks) used when deciding whether a price already lies on the
+# tick grid. Tick sizes such as 0.0001 are not exactly representable as floats,
+# so e.g. 0.3 / 0.0001 comes out as 2999.9999999999995 rather than 3000.
+TICK_EPSILON = 1e-9
+
+ROUND_NEAREST = 'nearest'
+ROUND_DOWN = 'down'
+ROUND_UP = 'up'
+
+def _to_ticks(price: float, inverse_tick_size: float, rounding: str) -> int:
+    ticks = price * inverse_tick_size
+    nearest = round(ticks)
+    if abs(ticks - nearest) <= TICK_EPSILON * max(1.0, abs(ticks)):
+        return int(nearest)
+    elif rounding == ROUND_NEAREST:
+        return int(nearest)
+    elif rounding == ROUND_DOWN:
+        return int(math.floor(ticks))
+    elif rounding == ROUND_UP:
+        return int(math.ceil(ticks))
+    else:
+        raise ValueError('Unknown rounding mode ' + rounding)
+
+# Number of decimal places needed to write down a multiple of tick_size, so that
+# e.g. 3 * 0.1 comes back as 0.3 rather than 0.30000000000000004
+def _tick_decimals(tick_size: float) -> int:
+    return max(0, -decimal.Decimal(repr(tick_size)).normalize().as_tuple().exponent)
+
+def round_to_tick(price: float, tick_size: float, rounding: str = ROUND_NEAREST) -> float:
+    return round(_to_ticks(price, 1.0 / tick_size, rounding) * tick_size, _tick_decimals(tick_size))
+
+_UnderlyingView = collections.namedtuple('_UnderlyingView', 'instruments last_trading_times')
+
+class _Entry(object):
+    __slots__ = ('instrument', 'tick_size', 'inverse_tick_size', 'tick_decimals', 'sort_key')
+
+    def __init__(self, instrument: dict):
+        self.instrument = instrument
+        self.tick_size = instrument.get('tickSize')
+        self.inverse_tick_size = None if not self.tick_size else 1.0 / self.tick_size
+        self.tick_decimals = None if not self.tick_size else _tick_decimals(self.tick_size)
+        # Instruments without an expiry (perpetuals, indices) sort after everything else
+        last_trading_time = instrument.get('lastTradingTime')
+        self.sort_key = (last_trading_time is None, last_trading_time or datetime.datetime.min, instrument['symbol'])
+
+# An in-memory index over the output of get_instruments(). Lookups by symbol are
+# a dict access, per-underlying views are kept sorted by lastTradingTime, and each
+# instrument's inverse tick size is computed once so that price <-> tick
+# conversions in order-construction loops are a multiply and a round.
+#
+# refresh() only rebuilds the per-underlying views that were actually affected
+# by instruments being added, removed or changed since the last refresh.
+class InstrumentIndex(object):
+    def __init__(self, instruments: List[dict] = None):
+        self._lock = threading.Lock()
+        self._entries = {}      # type: Dict[str, _Entry]
+        self._by_underlying = {} # type: Dict[str, _UnderlyingView]
+        self._sorted_symbols = [] # type: List[str]
+        self._symbols_by_underlying = collections.defaultdict(set) # type: Dict[str, set]
+        self.refresh(instruments)
+
+    # Pass instruments explicitly if you already have a recent get_instruments()
+    # result to hand. Returns the set of symbols that were added, removed or changed.
+    def refresh(self, instruments: List[dict] = None) -> set:
+        if instruments is None:
+            instruments = crypto_facilities.get_instruments()
+
+        with self._lock:
+            new_symbols = set()
+            changed = set()
+            added = set()
+            dirty_underlyings = set()
+            for instrument in instruments:
+                symbol = instrument['symbol']
+                new_symbols.add(symbol)
+                old = self._entries.get(symbol)
+                if old is not None and old.instrument == instrument:
+                    continue
+
+                changed.add(symbol)
+                if old is None:
+                    added.add(symbol)
+                else:
+                    self._remove_from_underlying(symbol, old, dirty_underlyings)
+                self._entries[symbol] = _Entry(instrument)
+                underlying = instrument.get('underlying')
+                self._symbols_by_underlying[underlying].add(symbol)
+                dirty_underlyings.add(underlying)
+
+            removed = set(self._entries) - new_symbols
+            for symbol in removed:
+                changed.add(symbol)
+                self._remove_from_underlying(symbol, self._entries.pop(symbol), dirty_underlyings)
+
+            if changed:
+                self._rebuild_views(dirty_underlyings, added, removed)
+
+            return changed
+
+    def _remove_from_underlying(self, symbol: str, entry: _Entry, dirty_underlyings: set):
+        underlying = entry.instrument.get('underlying')
+        symbols = self._symbols_by_underlying[underlying]
+        symbols.discard(symbol)
+        if not symbols:
+            del self._symbols_by_underlying[underlying]
+        dirty_underlyings.add(underlying)
+
+    # Only the underlyings that were touched are re-sorted, and the symbol list
+    # is only touched for symbols that were added or removed
+    def _rebuild_views(self, dirty_underlyings: set, added: set, removed: set):
+        # Readers may be holding a reference to the old dict and list, so build
+        # new ones rather than mutating them in place
+        new_views = dict(self._by_underlying)
+        for underlying in dirty_underlyings:
+            entries = [self._entries[s] for s in self._symbols_by_underlying.get(underlying, ())]
+            if entries:
+                entries.sort(key=lambda e: e.sort_key)
+                new_views[underlying] = _UnderlyingView(
+                    instruments=[e.instrument for e in entries],
+                    # Entries with an expiry sort first, so these line up with a prefix of instruments
+                    last_trading_times=[e.sort_key[1] for e in entries if not e.sort_key[0]],
+                )
+            else:
+                new_views.pop(underlying, None)
+
+        self._by_underlying = new_views
+        if added or removed:
+            sorted_symbols = [s for s in self._sorted_symbols if s not in removed] if removed else list(self._sorted_symbols)
+            for symbol in added:
+                bisect.insort(sorted_symbols, symbol)
+            self._sorted_symbols = sorted_symbols
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._entries
+
+    def __getitem__(self, symbol: str) -> dict:
+        return self._entries[symbol].instrument
+
+    def get(self, symbol: str, default: dict = None) -> Optional[dict]:
+        entry = self._entries.get(symbol)
+        return default if entry is None else entry.instrument
+
+    def symbols(self) -> List[str]:
+        return list(self._sorted_symbols)
+
+    def underlyings(self) -> List[str]:
+        return sorted(u for u in self._by_underlying if u is not None)
+
+    # e.g. with_prefix('fi_xbtusd_') for all the XBT/USD inverse futures
+    def with_prefix(self, prefix: str) -> List[dict]:
+        symbols = self._sorted_symbols
+        i = bisect.bisect_left(symbols, prefix)
+        result = []
+        while i < len(symbols) and symbols[i].startswith(prefix):
+            # Tolerate a concurrent refresh() having removed the symbol
+            entry = self._entries.get(symbols[i])
+            if entry is not None:
+                result.append(entry.instrument)
+            i += 1
+        return result
+
+    # Instruments on the given underlying, ordered by lastTradingTime (earliest
+    # first). Instruments with no lastTradingTime come last.
+    def by_underlying(self, underlying: str) -> List[dict]:
+        view = self._by_underlying.get(underlying)
+        return [] if view is None else list(view.instruments)
+
+    # Instruments on the given underlying which are still trading at the given
+    # time (default: now), earliest expiry first
+    def expiring_after(self, underlying: str, when: datetime.datetime = None) -> List[dict]:
+        if when is None:
+            when = datetime.datetime.now(datetime.timezone.utc)
+        view = self._by_underlying.get(underlying)
+        if view is None:
+            return []
+        times = view.last_trading_times
+        return view.instruments[bisect.bisect_right(times, when):len(times)]
+
+    def next_expiry(self, underlying: str, when: datetime.datetime = None, tradeable_only: bool = True) -> Optional[dict]:
+        for instrument in self.expiring_after(underlying, when):
+            if not tradeable_only or instrument.get('tradeable', True):
+                return instrument
+        return None
+
+    # Indices and the like have no tickSize, and so can't be priced in ticks
+    def _tick_entry(self, symbol: str) -> _Entry:
+        entry = self._entries[symbol]
+        if entry.inverse_tick_size is None:
+            raise ValueError('No tickSize for ' + symbol)
+        return entry
+
+    def tick_size(self, symbol: str) -> float:
+        return self._tick_entry(symbol).tick_size
+
+    def price_to_ticks(self, symbol: str, price: float, rounding: str = ROUND_NEAREST) -> int:
+        return _to_ticks(price, self._tick_entry(symbol).inverse_tick_size, rounding)
+
+    def ticks_to_price(self, symbol: str, ticks: int) -> float:
+        entry = self._tick_entry(symbol)
+        return round(ticks * entry.tick_size, entry.tick_decimals)
+
+    # Snaps price to the instrument's tick grid. When quoting passively you
+    # probably want ROUND_DOWN for buys and ROUND_UP for sells.
+    def round_price(self, symbol: str, price: float, rounding: str = ROUND_NEAREST) -> float:
+        entry = self._tick_entry(symbol)
+        return round(_to_ticks(price, entry.inverse_tick_size, rounding) * entry.tick_size, entry.tick_decimals)
+
+    def limit_order_spec(self, symbol: str, side: str, price: float) -> 'crypto_facilities.LimitOrderSpec':
+        rounding = ROUND_DOWN if side == 'buy' else ROUND_UP
+        return crypto_facilities.LimitOrderSpec(symbol, side, self.round_price(symbol, price, rounding))
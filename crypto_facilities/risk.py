@@ -0,0 +1,218 @@
+import copy
+import threading
+import time
+from typing import Callable, Dict, List
+
+import crypto_facilities
+from crypto_facilities import APIKey
+from crypto_facilities.instruments import InstrumentIndex
+
+# PnL and margin in a margin account move almost entirely with the mark prices
+# of the positions held in it, which get_tickers() already tells us about. So
+# rather than polling get_accounts() we take one snapshot of the accounts and
+# positions and then roll the PnL and margin figures forward from mark prices:
+#
+#  * For an inverse future (settled in the base currency, e.g. fi_xbtusd) a
+#    position of size contracts has PnL size * contractSize * (1/entry - 1/mark)
+#  * For a vanilla future it is size * contractSize * (mark - entry)
+#
+# and margin requirements are scaled by the change in the total absolute
+# notional of the account's positions, valued in the account currency.
+#
+# These are estimates: funding, fees and changes to the exchange's margin
+# schedule are not modelled, so call maybe_resync() regularly to fall back to
+# the authenticated calls on a slow cadence, or as soon as the estimated PnL
+# has moved by more than drift_threshold (as a fraction of the portfolio value).
+
+class _Position(object):
+    __slots__ = ('account', 'size', 'contract_size', 'inverse', 'mark0', 'mark')
+
+    def __init__(self, account: str, size: int, contract_size: float, inverse: bool, mark: float):
+        self.account = account
+        self.size = size
+        self.contract_size = contract_size
+        self.inverse = inverse
+        self.mark0 = mark
+        self.mark = mark
+
+    def pnl_since_snapshot(self) -> float:
+        if self.inverse:
+            return self.size * self.contract_size * (1.0 / self.mark0 - 1.0 / self.mark)
+        else:
+            return self.size * self.contract_size * (self.mark - self.mark0)
+
+    def exposure(self) -> float:
+        notional = abs(self.size * self.contract_size)
+        return notional / self.mark if self.inverse else notional * self.mark
+
+class _Account(object):
+    __slots__ = ('snapshot', 'pnl_delta', 'exposure0', 'exposure')
+
+    def __init__(self, snapshot: dict):
+        self.snapshot = snapshot
+        self.pnl_delta = 0.0
+        self.exposure0 = 0.0
+        self.exposure = 0.0
+
+def _signed_size(position: dict) -> int:
+    side = position['side']
+    if side in ('long', 'buy'):
+        return position['size']
+    elif side in ('short', 'sell'):
+        return -position['size']
+    else:
+        raise ValueError('Unknown side ' + side)
+
+# Margin account balances list the contracts held in them, but fall back on
+# matching the currency pair (e.g. "xbtusd") for positions that aren't listed
+def _find_account(symbol: str, accounts: dict) -> str:
+    for name, account in accounts.items():
+        if account.get('type') == 'marginAccount' and symbol in account.get('balances', {}):
+            return name
+
+    pair = symbol.split('_')[1] if '_' in symbol else symbol
+    for name, account in accounts.items():
+        if account.get('type') == 'marginAccount' and name.split('_')[-1] == pair:
+            return name
+
+    raise ValueError('No margin account for ' + symbol)
+
+def _marks(tickers: List[dict]) -> Dict[str, float]:
+    return {t['symbol']: t['markPrice'] for t in tickers if t.get('markPrice')}
+
+class RiskEstimator(object):
+    def __init__(self, key: APIKey, instruments: InstrumentIndex = None,
+                 resync_interval: float = 60.0, drift_threshold: float = 0.01,
+                 clock: Callable[[], float] = time.monotonic):
+        self.key = key
+        self.instruments = InstrumentIndex() if instruments is None else instruments
+        self.resync_interval = resync_interval
+        self.drift_threshold = drift_threshold
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._accounts = {}  # type: Dict[str, _Account]
+        self._positions = {} # type: Dict[str, _Position]
+        self._cash = {}
+        self.synced_at = None
+
+    # Takes a fresh snapshot with get_accounts() and get_positions(). Mark prices
+    # at the time of the snapshot come from tickers, which will be fetched if not
+    # supplied.
+    def sync(self, tickers: List[dict] = None):
+        accounts = crypto_facilities.get_accounts(self.key)
+        positions = crypto_facilities.get_positions(self.key)
+        if tickers is None:
+            tickers = crypto_facilities.get_tickers()
+        marks = _marks(tickers)
+
+        new_accounts = {
+            name: _Account(account)
+            for name, account in accounts.items()
+            if account.get('type') == 'marginAccount'
+        }
+
+        new_positions = {}
+        for position in positions:
+            symbol = position['symbol']
+            instrument = self.instruments.get(symbol)
+            if instrument is None:
+                self.instruments.refresh()
+                instrument = self.instruments[symbol]
+
+            p = new_positions.get(symbol)
+            if p is None:
+                p = new_positions[symbol] = _Position(
+                    account=_find_account(symbol, accounts),
+                    size=0,
+                    contract_size=instrument.get('contractSize', 1),
+                    inverse=instrument.get('type') == 'futures_inverse',
+                    mark=marks.get(symbol, position['price']),
+                )
+            p.size += _signed_size(position)
+
+        for p in new_positions.values():
+            account = new_accounts[p.account]
+            account.exposure0 += p.exposure()
+            account.exposure = account.exposure0
+
+        with self._lock:
+            self._accounts = new_accounts
+            self._positions = new_positions
+            self._cash = {name: account for name, account in accounts.items() if name not in new_accounts}
+            self.synced_at = self.clock()
+
+    # Rolls the estimates forward using the markPrice of each ticker. Tickers
+    # for symbols we hold no position in are ignored.
+    def update_tickers(self, tickers: List[dict]):
+        with self._lock:
+            for symbol, mark in _marks(tickers).items():
+                self._update_mark(symbol, mark)
+
+    def update_mark(self, symbol: str, mark: float):
+        with self._lock:
+            self._update_mark(symbol, mark)
+
+    def _update_mark(self, symbol: str, mark: float):
+        p = self._positions.get(symbol)
+        if p is None or p.mark == mark:
+            return
+
+        account = self._accounts[p.account]
+        old_pnl, old_exposure = p.pnl_since_snapshot(), p.exposure()
+        p.mark = mark
+        account.pnl_delta += p.pnl_since_snapshot() - old_pnl
+        account.exposure += p.exposure() - old_exposure
+
+    # The estimated change in PnL since the last sync, as a fraction of the
+    # portfolio value at that sync, for whichever account has moved the most
+    def drift(self) -> float:
+        worst = 0.0
+        for account in self._accounts.values():
+            pv = abs(account.snapshot.get('auxiliary', {}).get('pv', 0.0))
+            if pv > 0:
+                worst = max(worst, abs(account.pnl_delta) / pv)
+            elif account.pnl_delta:
+                return float('inf')
+        return worst
+
+    def needs_resync(self) -> bool:
+        return (self.synced_at is None
+                or self.clock() - self.synced_at >= self.resync_interval
+                or self.drift() > self.drift_threshold)
+
+    # Returns True if a sync was performed
+    def maybe_resync(self, tickers: List[dict] = None) -> bool:
+        if tickers is not None:
+            self.update_tickers(tickers)
+        if not self.needs_resync():
+            return False
+        self.sync(tickers)
+        return True
+
+    # Estimated equivalent of get_accounts(). Margin accounts have their
+    # "auxiliary" and "marginRequirements" sections rolled forward from the
+    # latest mark prices; everything else is as of the last sync.
+    def get_accounts(self) -> dict:
+        if self.synced_at is None:
+            raise ValueError('RiskEstimator has not been synced')
+
+        with self._lock:
+            result = copy.deepcopy(self._cash)
+            for name, account in self._accounts.items():
+                result[name] = estimate = copy.deepcopy(account.snapshot)
+
+                scale = 1.0 if account.exposure0 == 0 else account.exposure / account.exposure0
+                requirements = estimate.get('marginRequirements', {})
+                im_delta = requirements.get('im', 0.0) * (scale - 1.0)
+                for k in requirements:
+                    requirements[k] *= scale
+
+                auxiliary = estimate.get('auxiliary', {})
+                for k in ('pnl', 'pv'):
+                    if k in auxiliary:
+                        auxiliary[k] += account.pnl_delta
+                if 'af' in auxiliary:
+                    auxiliary['af'] += account.pnl_delta - im_delta
+
+            return result
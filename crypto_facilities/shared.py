@@ -0,0 +1,350 @@
+import array
+import collections
+import datetime
+import math
+import struct
+import threading
+import time
+from typing import Dict, List, Optional
+
+from crypto_facilities import OrderBook
+
+# Lets one process (e.g. one polling the REST API, or running a
+# crypto_facilities.feed.FeedClient) share the latest order books and tickers
+# with any number of other processes on the same machine, without them making
+# API calls or unpickling anything.
+#
+# Everything lives in one fixed-layout block of shared memory made up of 8-byte
+# words:
+#
+#   header     magic, layout version, number of symbols, depth, ring length
+#   directory  one 32-byte, NUL-padded symbol name per symbol
+#   per symbol a book ring followed by a ticker ring
+#
+# A ring is a write count followed by ring_length frames, and a frame is a
+# sequence number followed by the payload. The publisher writes each snapshot
+# into the next frame of the ring under a seqlock (the sequence number is odd
+# while the frame is being written) and then bumps the write count. Readers go
+# straight to the newest frame, and retry if its sequence number was odd or
+# changed while they were reading. Since the publisher is always writing to a
+# different frame from the newest one, that only happens if a reader is so slow
+# that the publisher laps the whole ring.
+#
+# This relies on stores becoming visible to other processes in program order,
+# which holds on x86 but is not guaranteed on weaker memory models such as ARM.
+
+_MAGIC, = struct.unpack('<Q', b'CFSHM001')
+_LAYOUT_VERSION = 1
+_HEADER_WORDS = 8
+_SYMBOL_BYTES = 32
+
+# Fields of get_tickers() records that are shared. Missing values are stored as NaN.
+TICKER_FIELDS = ('bid', 'bidSize', 'ask', 'askSize', 'last', 'lastSize', 'lastTime',
+                 'open24h', 'high24h', 'low24h', 'vol24h', 'markPrice', 'suspended')
+_INT_TICKER_FIELDS = frozenset(('bidSize', 'askSize', 'lastSize', 'vol24h'))
+
+# A zero-copy view of a book frame: bids and asks are flat [price, size, price,
+# size, ...] memoryviews straight into shared memory. They are only guaranteed
+# to be consistent if SnapshotReader.still_valid(view) holds after you are done
+# reading them, and must be released before the reader is closed.
+BookView = collections.namedtuple('BookView', 'symbol time bids asks frame seq')
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+def _to_seconds(t: datetime.datetime) -> float:
+    return (t - _EPOCH).total_seconds()
+
+def _from_seconds(s: float) -> datetime.datetime:
+    import pytz
+    return datetime.datetime.fromtimestamp(s, pytz.UTC)
+
+def _layout(n_symbols: int, depth: int, ring_length: int):
+    book_words = 1 + 3 + 4 * depth     # seq, time, n_bids, n_asks, bids, asks
+    ticker_words = 1 + len(TICKER_FIELDS) # seq, fields
+    book_ring_words = 1 + ring_length * book_words
+    ticker_ring_words = 1 + ring_length * ticker_words
+    symbols_words = n_symbols * _SYMBOL_BYTES // 8
+    slot_words = book_ring_words + ticker_ring_words
+    total_words = _HEADER_WORDS + symbols_words + n_symbols * slot_words
+    return book_words, ticker_words, book_ring_words, symbols_words, slot_words, total_words
+
+class _Ring(object):
+    __slots__ = ('words', 'floats', 'offset', 'ring_length', 'frame_words')
+
+    def __init__(self, words: memoryview, floats: memoryview, offset: int, ring_length: int, frame_words: int):
+        self.words = words
+        self.floats = floats
+        self.offset = offset
+        self.ring_length = ring_length
+        self.frame_words = frame_words
+
+    def frame_offset(self, frame: int) -> int:
+        return self.offset + 1 + frame * self.frame_words
+
+    def write(self, payload: List[float]):
+        words, count = self.words, self.words[self.offset]
+        frame = self.frame_offset(count % self.ring_length)
+        seq = words[frame]
+        words[frame] = seq + 1
+        self.floats[frame + 1:frame + 1 + len(payload)] = array.array('d', payload)
+        words[frame] = seq + 2
+        words[self.offset] = count + 1
+
+    # Returns (frame offset, sequence number) of the newest complete frame, or None
+    def latest(self) -> Optional[tuple]:
+        words = self.words
+        while True:
+            count = words[self.offset]
+            if count == 0:
+                return None
+            frame = self.frame_offset((count - 1) % self.ring_length)
+            seq = words[frame]
+            if not seq & 1:
+                return frame, seq
+
+    def read(self) -> Optional[List[float]]:
+        while True:
+            latest = self.latest()
+            if latest is None:
+                return None
+            frame, seq = latest
+            payload = self.floats[frame + 1:frame + self.frame_words].tolist()
+            if self.words[frame] == seq:
+                return payload
+
+class _SharedBlock(object):
+    def __init__(self, shm, symbols: List[str], depth: int, ring_length: int):
+        self.shm = shm
+        self.symbols = symbols
+        self.depth = depth
+        self.ring_length = ring_length
+
+        book_words, ticker_words, book_ring_words, symbols_words, slot_words, total_words = _layout(len(symbols), depth, ring_length)
+        self.words = shm.buf[:total_words * 8].cast('Q')
+        self.floats = shm.buf[:total_words * 8].cast('d')
+
+        self.books = {}   # type: Dict[str, _Ring]
+        self.tickers = {} # type: Dict[str, _Ring]
+        for i, symbol in enumerate(symbols):
+            offset = _HEADER_WORDS + symbols_words + i * slot_words
+            self.books[symbol] = _Ring(self.words, self.floats, offset, ring_length, book_words)
+            self.tickers[symbol] = _Ring(self.words, self.floats, offset + book_ring_words, ring_length, ticker_words)
+
+    def close(self):
+        # Views have to be released before the shared memory can be closed
+        self.books.clear()
+        self.tickers.clear()
+        self.words.release()
+        self.floats.release()
+        self.shm.close()
+
+# Owns the shared memory: create it once in the market data process with the
+# full list of symbols you will ever want to share, and unlink() it on shutdown.
+# Only one thread may publish at a time.
+class SnapshotPublisher(object):
+    def __init__(self, name: str, symbols: List[str], depth: int = 25, ring_length: int = 8):
+        from multiprocessing import shared_memory
+
+        for symbol in symbols:
+            if len(symbol.encode('utf8')) > _SYMBOL_BYTES:
+                raise ValueError('Symbol too long: ' + symbol)
+        if ring_length < 2:
+            raise ValueError('ring_length must be at least 2')
+
+        size = _layout(len(symbols), depth, ring_length)[-1] * 8
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        shm.buf[:size] = bytes(size)
+        struct.pack_into('<QQQQQ', shm.buf, 0, _MAGIC, _LAYOUT_VERSION, len(symbols), depth, ring_length)
+        for i, symbol in enumerate(symbols):
+            struct.pack_into('%ds' % _SYMBOL_BYTES, shm.buf, _HEADER_WORDS * 8 + i * _SYMBOL_BYTES, symbol.encode('utf8'))
+
+        self.name = name
+        self._block = _SharedBlock(shm, list(symbols), depth, ring_length)
+
+    @property
+    def symbols(self) -> List[str]:
+        return list(self._block.symbols)
+
+    # Books deeper than the depth given at creation time are truncated
+    def publish_order_book(self, symbol: str, book: OrderBook, when: datetime.datetime = None):
+        depth = self._block.depth
+        bids, asks = book.bids[:depth], book.asks[:depth]
+        payload = [time.time() if when is None else _to_seconds(when), len(bids), len(asks)]
+        payload.extend(x for level in bids for x in level)
+        payload.extend([0.0] * (2 * (depth - len(bids))))
+        payload.extend(x for level in asks for x in level)
+        self._block.books[symbol].write(payload)
+
+    def publish_ticker(self, ticker: dict):
+        payload = []
+        for field in TICKER_FIELDS:
+            value = ticker.get(field)
+            if value is None:
+                payload.append(math.nan)
+            elif field == 'lastTime':
+                payload.append(_to_seconds(value))
+            else:
+                payload.append(float(value))
+        self._block.tickers[ticker['symbol']].write(payload)
+
+    # e.g. the output of get_tickers(). Tickers for symbols that aren't being shared are skipped.
+    def publish_tickers(self, tickers: List[dict]):
+        rings = self._block.tickers
+        for ticker in tickers:
+            if ticker['symbol'] in rings:
+                self.publish_ticker(ticker)
+
+    # For crypto_facilities.feed.FeedEvents. Events other than books and tickers are ignored.
+    def publish_event(self, event):
+        if event.symbol not in self._block.books:
+            return
+        if event.feed == 'book':
+            self.publish_order_book(event.symbol, event.record)
+        elif event.feed == 'ticker':
+            self.publish_ticker(event.record)
+
+    def close(self):
+        self._block.close()
+
+    def unlink(self):
+        self._block.shm.unlink()
+
+    def __enter__(self) -> 'SnapshotPublisher':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        self.unlink()
+
+_attach_lock = threading.Lock()
+
+# Attaches to an existing block without registering it with the resource
+# tracker, which would otherwise destroy the block when this process exits.
+# Before Python 3.13 there is no way to ask for that, and unregistering after
+# the fact isn't an option: the tracker is shared with any publisher in this
+# process and with spawned children, so that would drop the publisher's own
+# registration. Instead we briefly intercept the registration of this one block.
+def _attach(name: str):
+    from multiprocessing import resource_tracker, shared_memory
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    attaching_thread = threading.current_thread()
+    with _attach_lock:
+        register = resource_tracker.register
+
+        def register_unless_attaching(resource_name, resource_type):
+            if (resource_type == 'shared_memory' and resource_name.lstrip('/') == name.lstrip('/')
+                    and threading.current_thread() is attaching_thread):
+                return
+            register(resource_name, resource_type)
+
+        resource_tracker.register = register_unless_attaching
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+# Sizes come back as ints when they are whole numbers, as they are from the REST API
+def _size(x: float):
+    return int(x) if x.is_integer() else x
+
+class SnapshotReader(object):
+    def __init__(self, name: str):
+        shm = _attach(name)
+
+        magic, version, n_symbols, depth, ring_length = struct.unpack_from('<QQQQQ', shm.buf, 0)
+        if magic != _MAGIC or version != _LAYOUT_VERSION:
+            shm.close()
+            raise ValueError('Shared memory block ' + name + ' was not created by a compatible SnapshotPublisher')
+
+        symbols = []
+        for i in range(n_symbols):
+            raw, = struct.unpack_from('%ds' % _SYMBOL_BYTES, shm.buf, _HEADER_WORDS * 8 + i * _SYMBOL_BYTES)
+            symbols.append(raw.rstrip(b'\0').decode('utf8'))
+
+        self.name = name
+        self._block = _SharedBlock(shm, symbols, depth, ring_length)
+
+    @property
+    def symbols(self) -> List[str]:
+        return list(self._block.symbols)
+
+    # The newest consistent book, or None if none has been published yet
+    def get_order_book(self, symbol: str) -> Optional[OrderBook]:
+        ring = self._block.books[symbol]
+        depth = self._block.depth
+        while True:
+            latest = ring.latest()
+            if latest is None:
+                return None
+            frame, seq = latest
+            floats = ring.floats
+            n_bids, n_asks = int(floats[frame + 2]), int(floats[frame + 3])
+            bids = floats[frame + 4:frame + 4 + 2 * n_bids].tolist()
+            asks_start = frame + 4 + 2 * depth
+            asks = floats[asks_start:asks_start + 2 * n_asks].tolist()
+            if ring.words[frame] == seq:
+                return OrderBook(
+                    bids=[[bids[i], _size(bids[i + 1])] for i in range(0, len(bids), 2)],
+                    asks=[[asks[i], _size(asks[i + 1])] for i in range(0, len(asks), 2)],
+                )
+
+    def get_order_book_view(self, symbol: str) -> Optional[BookView]:
+        ring = self._block.books[symbol]
+        depth = self._block.depth
+        latest = ring.latest()
+        if latest is None:
+            return None
+        frame, seq = latest
+        floats = ring.floats
+        n_bids, n_asks = int(floats[frame + 2]), int(floats[frame + 3])
+        asks_start = frame + 4 + 2 * depth
+        return BookView(
+            symbol=symbol,
+            time=floats[frame + 1],
+            bids=floats[frame + 4:frame + 4 + 2 * n_bids],
+            asks=floats[asks_start:asks_start + 2 * n_asks],
+            frame=frame,
+            seq=seq,
+        )
+
+    # True if the frame behind the view hasn't been overwritten since it was taken
+    def still_valid(self, view: BookView) -> bool:
+        return self._block.words[view.frame] == view.seq
+
+    # The newest consistent ticker, as a get_tickers() record, or None if none has been published yet
+    def get_ticker(self, symbol: str) -> Optional[dict]:
+        payload = self._block.tickers[symbol].read()
+        if payload is None:
+            return None
+
+        ticker = {'symbol': symbol}
+        for field, value in zip(TICKER_FIELDS, payload):
+            if math.isnan(value):
+                continue
+            elif field == 'lastTime':
+                ticker[field] = _from_seconds(value)
+            elif field == 'suspended':
+                ticker[field] = bool(value)
+            elif field in _INT_TICKER_FIELDS:
+                ticker[field] = _size(value)
+            else:
+                ticker[field] = value
+        return ticker
+
+    def get_tickers(self) -> List[dict]:
+        tickers = (self.get_ticker(symbol) for symbol in self._block.symbols)
+        return [t for t in tickers if t is not None]
+
+    def close(self):
+        self._block.close()
+
+    def __enter__(self) -> 'SnapshotReader':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,116 @@
+from hamcrest import *
+from datetime import datetime, timedelta, timezone
+import random
+
+from crypto_facilities import Trade
+from crypto_facilities.bars import Bar, BarBuilder, bars_from_trades
+
+T0 = datetime(2016, 2, 23, 10, 0, tzinfo=timezone.utc)
+
+def make_trades(n, seed=0):
+	rng = random.Random(seed)
+	trades = []
+	t = T0
+	for trade_id in range(n):
+		t += timedelta(milliseconds=rng.randrange(0, 3000))
+		trades.append(Trade(time=t, trade_id=trade_id, price=rng.randrange(4200, 4300), size=rng.randrange(1, 5000)))
+	return trades
+
+def test_bars_from_trades():
+	trades = [
+		Trade(T0 + timedelta(seconds=0.5), 1, 4322, 100),
+		Trade(T0 + timedelta(seconds=0.7), 2, 4330, 200),
+		Trade(T0 + timedelta(seconds=0.9), 3, 4310, 300),
+		Trade(T0 + timedelta(seconds=61),  4, 4300, 400),
+	]
+	# Pages come back newest first and overlap
+	bars = bars_from_trades(list(reversed(trades)) + trades[:2], [1, 60])
+
+	assert bars[1] == [
+		Bar(T0, 1, 4322, 4330, 4310, 4310, 600, 3),
+		Bar(T0 + timedelta(seconds=61), 1, 4300, 4300, 4300, 4300, 400, 1),
+	]
+	assert bars[60] == [
+		Bar(T0, 60, 4322, 4330, 4310, 4310, 600, 3),
+		Bar(T0 + timedelta(seconds=60), 60, 4300, 4300, 4300, 4300, 400, 1),
+	]
+
+def test_bars_from_no_trades():
+	assert bars_from_trades([], [60]) == {60: []}
+
+def test_streaming_matches_batch():
+	trades = make_trades(2000)
+	expected = bars_from_trades(trades, [1, 60, 90])
+
+	builder = BarBuilder([90, 1, 60])
+	closed = []
+	# Overlapping newest-first pages, as returned by get_trade_history
+	for i in range(0, len(trades), 80):
+		closed.extend(builder.add_many(reversed(trades[i:i + 100])))
+	closed.extend(builder.flush())
+
+	for interval in (1, 60, 90):
+		assert [b for b in closed if b.interval == interval] == expected[interval]
+
+def test_streaming_late_trades():
+	builder = BarBuilder([1])
+	assert builder.add(Trade(T0 + timedelta(seconds=1), 2, 4300, 1)) == []
+	assert builder.add(Trade(T0, 1, 4310, 1)) == []
+	assert builder.stale_trades == 1
+
+	closed = builder.add(Trade(T0 + timedelta(seconds=2), 3, 4320, 1))
+	assert closed == [Bar(T0 + timedelta(seconds=1), 1, 4300, 4300, 4300, 4300, 1, 1)]
+	assert_that(builder.open_bars(), has_entries({1: Bar(T0 + timedelta(seconds=2), 1, 4320, 4320, 4320, 4320, 1, 1)}))
+
+def test_batch_and_streaming_agree_on_fractional_sizes_and_string_ids():
+	trades = [
+		Trade(T0 + timedelta(seconds=0.5), 'b7', 4322, 0.5),
+		Trade(T0 + timedelta(seconds=0.5), 'a3', 4330, 1.5),
+		Trade(T0 + timedelta(seconds=1.2), 'c1', 4310, 0.25),
+	]
+	expected = [
+		Bar(T0, 1, 4330, 4330, 4322, 4322, 2.0, 2),
+		Bar(T0 + timedelta(seconds=1), 1, 4310, 4310, 4310, 4310, 0.25, 1),
+	]
+	assert bars_from_trades(trades, [1])[1] == expected
+
+	builder = BarBuilder([1])
+	assert builder.add_many(trades) + builder.flush() == expected
+
+def test_streaming_out_of_order_within_bar():
+	trades = [
+		Trade(T0 + timedelta(seconds=0.9), 1, 100, 1),
+		Trade(T0 + timedelta(seconds=0.1), 2, 200, 1),
+		Trade(T0 + timedelta(seconds=0.5), 3, 150, 1),
+	]
+	expected = bars_from_trades(trades, [1, 60])
+	assert expected[1] == [Bar(T0, 1, 200, 200, 100, 100, 3, 3)]
+
+	builder = BarBuilder([1, 60])
+	for trade in trades:
+		assert builder.add(trade) == []
+	assert builder.stale_trades == 0
+	closed = builder.flush()
+
+	for interval in (1, 60):
+		assert [b for b in closed if b.interval == interval] == expected[interval]
+
+def test_streaming_intervals_that_dont_divide():
+	builder = BarBuilder([60, 90])
+	builder.add(Trade(T0 + timedelta(seconds=95), 1, 4300, 1))
+	# Still inside the open 60s bar, but before the open 90s bar
+	assert builder.add(Trade(T0 + timedelta(seconds=85), 2, 4310, 1)) == []
+	assert builder.stale_trades == 1
+	assert builder.flush() == [
+		Bar(T0 + timedelta(seconds=60), 60, 4300, 4300, 4300, 4300, 1, 1),
+		Bar(T0 + timedelta(seconds=90), 90, 4300, 4300, 4300, 4300, 1, 1),
+	]
+
+	# In order, streaming matches batch
+	trades = make_trades(2000, seed=1)
+	expected = bars_from_trades(trades, [60, 90])
+	builder = BarBuilder([60, 90])
+	closed = builder.add_many(trades) + builder.flush()
+	assert builder.stale_trades == 0
+	for interval in (60, 90):
+		assert [b for b in closed if b.interval == interval] == expected[interval]
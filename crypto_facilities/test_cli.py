@@ -0,0 +1,59 @@
+from hamcrest import *
+from datetime import datetime, timedelta, timezone
+import io
+import json
+import os
+import subprocess
+import sys
+
+import crypto_facilities
+from crypto_facilities import Trade
+from crypto_facilities.cli import main
+
+T0 = datetime(2018, 3, 1, tzinfo=timezone.utc)
+
+# 250 trades, several sharing each timestamp so that page boundaries land mid-timestamp
+TRADES = [Trade(T0 + timedelta(seconds=i // 3), i, 4000 + i, 1) for i in range(250)]
+
+def fake_trade_history(symbol, last_time=None):
+	newest_first = sorted(TRADES, key=lambda t: t.trade_id, reverse=True)
+	return [t for t in newest_first if last_time is None or t.time <= last_time][:100]
+
+def run(argv):
+	out = io.StringIO()
+	assert main(argv, out=out) == 0
+	return [json.loads(line) for line in out.getvalue().splitlines()]
+
+def test_import_is_lazy():
+	code = 'import sys, crypto_facilities; print(sorted(m for m in ("requests", "pytz", "json", "hmac") if m in sys.modules))'
+	root = os.path.dirname(os.path.dirname(os.path.abspath(crypto_facilities.__file__)))
+	assert subprocess.check_output([sys.executable, '-c', code], cwd=root).decode().strip() == '[]'
+
+def test_trades_latest_page(monkeypatch):
+	monkeypatch.setattr(crypto_facilities, 'get_trade_history', fake_trade_history)
+	records = run(['trades', 'fi_xbtusd_180615'])
+	assert len(records) == 100
+	assert records[0] == {'time': '2018-03-01T00:01:23.000Z', 'trade_id': 249, 'price': 4249, 'size': 1}
+
+def test_trades_since(monkeypatch):
+	monkeypatch.setattr(crypto_facilities, 'get_trade_history', fake_trade_history)
+	assert [r['trade_id'] for r in run(['trades', 'fi_xbtusd_180615', '--since', '2018-03-01T00:00:00Z'])] == list(range(249, -1, -1))
+	assert [r['trade_id'] for r in run(['trades', 'fi_xbtusd_180615', '--since', '2018-03-01T00:00:50'])] == list(range(249, 149, -1))
+
+def test_trades_since_stuck_on_one_timestamp(monkeypatch):
+	# More trades at one time than fit in a page, so paging can't get past them
+	trades = TRADES[:100] + [Trade(T0 + timedelta(seconds=40), i, 4000, 1) for i in range(250, 400)]
+	def history(symbol, last_time=None):
+		newest_first = sorted(trades, key=lambda t: (t.time, t.trade_id), reverse=True)
+		return [t for t in newest_first if last_time is None or t.time <= last_time][:100]
+	monkeypatch.setattr(crypto_facilities, 'get_trade_history', history)
+
+	out = io.StringIO()
+	try:
+		main(['trades', 'fi_xbtusd_180615', '--since', '2018-03-01T00:00:00Z'], out=out)
+	except SystemExit as e:
+		assert_that(str(e.code), contains_string('2018-03-01T00:00:40.000Z'))
+	else:
+		raise AssertionError('Expected the dump to fail')
+	# What was fetched before getting stuck has still been written out
+	assert len(out.getvalue().splitlines()) == 100
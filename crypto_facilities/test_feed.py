@@ -0,0 +1,214 @@
+from hamcrest import *
+import base64
+import threading
+import time
+
+from crypto_facilities import APIKey, OrderBook, OrderStatus, LimitOrderSpec, Trade
+from crypto_facilities.bars import BarBuilder, bars_from_trades
+from crypto_facilities.fake_feed import FakeFeedServer
+from crypto_facilities.feed import FeedClient
+
+KEY = APIKey('public', base64.b64encode(b'private').decode('ascii'))
+
+def collect(client, predicate, timeout=5.0):
+	# Runs the client until predicate(events) holds, or the timeout expires
+	events = []
+	timer = threading.Timer(timeout, client.close)
+	timer.start()
+	try:
+		for event in client.events():
+			events.append(event)
+			if predicate(events):
+				break
+	finally:
+		timer.cancel()
+	return events
+
+def wait_for(condition, timeout=5.0):
+	deadline = time.time() + timeout
+	while not condition():
+		assert time.time() < deadline
+		time.sleep(0.01)
+
+def test_book_snapshot_and_deltas():
+	with FakeFeedServer() as server:
+		server.set_book('pi_xbtusd', bids=[[4000, 10], [3999, 5]], asks=[[4001, 7]])
+
+		client = FeedClient(server.url)
+		client.subscribe('book', ['pi_xbtusd'])
+		events = collect(client, lambda es: len(es) == 1)
+		assert events[0].feed == 'book'
+		assert events[0].symbol == 'pi_xbtusd'
+		assert events[0].record == OrderBook(bids=[[4000, 10], [3999, 5]], asks=[[4001, 7]])
+
+		server.update_book('pi_xbtusd', 'buy', 4000, 0)
+		server.update_book('pi_xbtusd', 'sell', 4002, 3)
+		events = collect(client, lambda es: len(es) == 2)
+		assert events[-1].record == OrderBook(bids=[[3999, 5]], asks=[[4001, 7], [4002, 3]])
+		client.close()
+
+def test_book_depth():
+	with FakeFeedServer() as server:
+		server.set_book('pi_xbtusd', bids=[[4000, 10], [3999, 5], [3998, 1]], asks=[[4001, 7], [4002, 3]])
+
+		client = FeedClient(server.url, book_depth=2)
+		client.subscribe('book', ['pi_xbtusd'])
+		events = collect(client, lambda es: len(es) == 1)
+		assert events[0].record == OrderBook(bids=[[4000, 10], [3999, 5]], asks=[[4001, 7], [4002, 3]])
+
+		server.update_book('pi_xbtusd', 'buy', 4000, 0)
+		server.update_book('pi_xbtusd', 'buy', 3999.5, 2)
+		server.update_book('pi_xbtusd', 'sell', 4000.5, 1)
+		server.update_book('pi_xbtusd', 'sell', 4002, 0)
+		events = collect(client, lambda es: len(es) == 4)
+		assert events[-1].record == OrderBook(bids=[[3999.5, 2], [3999, 5]], asks=[[4000.5, 1], [4001, 7]])
+		client.close()
+
+def test_close_from_another_thread():
+	with FakeFeedServer(heartbeat_interval=0.001) as server:
+		for delay in (0, 0.001, 0.005, 0.02, 0.05) * 4:
+			client = FeedClient(server.url)
+			client.subscribe('book', ['pi_xbtusd'])
+			timer = threading.Timer(delay, client.close)
+			timer.start()
+			# Whenever close() lands, events() must simply stop rather than raise
+			for event in client.events():
+				assert event.feed == 'book'
+			timer.join()
+
+def test_book_gap_triggers_resubscribe():
+	with FakeFeedServer() as server:
+		server.set_book('pi_xbtusd', bids=[[4000, 10]], asks=[[4001, 7]])
+
+		client = FeedClient(server.url)
+		client.subscribe('book', ['pi_xbtusd'])
+		collect(client, lambda es: len(es) == 1)
+
+		server.update_book('pi_xbtusd', 'buy', 3999, 1, skip_seq=True)
+		events = collect(client, lambda es: len(es) == 1)
+		# The book comes back from a fresh snapshot, including the update we missed the start of
+		assert events[0].record == OrderBook(bids=[[4000, 10], [3999, 1]], asks=[[4001, 7]])
+		assert client.gaps == 1
+		client.close()
+
+def test_stale_book_delta_after_snapshot():
+	client = FeedClient('ws://127.0.0.1:1/ws/v1')
+	client._handle({'feed': 'book_snapshot', 'product_id': 'PI_XBTUSD', 'seq': 5,
+	                'bids': [{'price': 4000, 'qty': 10}], 'asks': [{'price': 4001, 'qty': 7}]})
+
+	# The snapshot already includes update 5, so its delta is dropped rather than treated as a gap
+	delta = {'feed': 'book', 'product_id': 'PI_XBTUSD', 'side': 'buy', 'price': 4000, 'qty': 3}
+	assert client._handle(dict(delta, seq=4)) == []
+	assert client._handle(dict(delta, seq=5)) == []
+	assert client.gaps == 0
+
+	events = client._handle(dict(delta, seq=6, qty=2))
+	assert events == [('book', 'pi_xbtusd', OrderBook(bids=[[4000, 2]], asks=[[4001, 7]]))]
+	assert client.gaps == 0
+
+def test_fake_feed_deltas_follow_snapshot():
+	import json
+	import websocket
+
+	with FakeFeedServer() as server:
+		server.set_book('pi_xbtusd', bids=[[4000, 10]], asks=[[4001, 7]])
+		stop = threading.Event()
+		def publish():
+			# One publisher thread, as in fake_feed.main()
+			i = 0
+			while not stop.is_set():
+				i += 1
+				server.update_book('pi_xbtusd', 'buy', 3000 + i % 500, i)
+		publisher = threading.Thread(target=publish)
+		publisher.start()
+		try:
+			for _ in range(20):
+				ws = websocket.create_connection(server.url, timeout=5)
+				ws.send(json.dumps({'event': 'subscribe', 'feed': 'book', 'product_ids': ['PI_XBTUSD']}))
+				messages = []
+				while len(messages) < 2:
+					message = json.loads(ws.recv())
+					if 'event' not in message and message.get('feed') in ('book_snapshot', 'book'):
+						messages.append(message)
+				ws.close()
+				snapshot, delta = messages
+				assert snapshot['feed'] == 'book_snapshot'
+				assert delta['seq'] == snapshot['seq'] + 1
+		finally:
+			stop.set()
+			publisher.join()
+
+def test_tickers_and_trades():
+	with FakeFeedServer() as server:
+		uid = server.publish_trade('pi_xbtusd', 4000, 10, time_ms=1456394753000)
+
+		client = FeedClient(server.url)
+		client.subscribe('ticker', ['pi_xbtusd'])
+		client.subscribe('trade', ['pi_xbtusd'])
+		events = collect(client, lambda es: len(es) == 1)
+		assert events[0] == ('trade', 'pi_xbtusd', Trade(events[0].record.time, uid, 4000, 10))
+		assert events[0].record.time.timestamp() == 1456394753
+
+		wait_for(lambda: server.subscriber_count('ticker', 'pi_xbtusd') == 1)
+		server.publish_ticker('pi_xbtusd', bid=4000, bid_size=10, ask=4001, ask_size=5, markPrice=4000.5, suspended=False)
+		events = collect(client, lambda es: len(es) == 1)
+		assert events[0].feed == 'ticker'
+		assert events[0].record == {'symbol': 'pi_xbtusd', 'bid': 4000, 'bidSize': 10, 'ask': 4001, 'askSize': 5, 'markPrice': 4000.5, 'suspended': False}
+		client.close()
+
+def test_private_feeds():
+	with FakeFeedServer(keys=[KEY]) as server:
+		order_id = server.publish_open_order('fi_xbtusd_180615', 'buy', 5, 4000)
+
+		client = FeedClient(server.url, key=KEY)
+		client.subscribe('open_orders')
+		client.subscribe('fills')
+		events = collect(client, lambda es: len(es) == 1)
+		assert events[0].feed == 'open_orders'
+		assert events[0].record.spec == LimitOrderSpec('fi_xbtusd_180615', 'buy', 4000)
+		assert events[0].record.status.order_id == order_id
+		assert events[0].record.unfilled_size == 5
+
+		wait_for(lambda: server.subscriber_count('fills') == 1)
+		server.publish_fill('fi_xbtusd_180615', 'buy', 2, 4000, order_id=order_id)
+		server.cancel_open_order(order_id)
+		events = collect(client, lambda es: len(es) == 2)
+		assert_that(events[0].record, has_entries({'symbol': 'fi_xbtusd_180615', 'side': 'buy', 'size': 2, 'order_id': order_id}))
+		assert events[1].record == OrderStatus(received_time=None, status='cancelled', order_id=order_id)
+		client.close()
+
+def test_reconnects_after_drop():
+	with FakeFeedServer(heartbeat_interval=0.05) as server:
+		server.set_book('pi_xbtusd', bids=[[4000, 10]], asks=[[4001, 7]])
+
+		client = FeedClient(server.url, heartbeat_timeout=1.0, reconnect_delay=0.01)
+		client.subscribe('book', ['pi_xbtusd'])
+		collect(client, lambda es: len(es) == 1)
+
+		server.drop_connections()
+		events = collect(client, lambda es: len(es) == 1)
+		assert events[0].record == OrderBook(bids=[[4000, 10]], asks=[[4001, 7]])
+		assert client.reconnects == 1
+		client.close()
+
+def test_feed_trades_into_bars():
+	with FakeFeedServer() as server:
+		start_ms = 1456394753000
+		for i, (price, qty) in enumerate([(4000, 10), (4010, 5), (3990, 1), (4005, 2)]):
+			server.publish_trade('pi_xbtusd', price, qty, time_ms=start_ms + i * 400)
+
+		client = FeedClient(server.url)
+		client.subscribe('trade', ['pi_xbtusd'])
+		trades = [event.record for event in collect(client, lambda es: len(es) == 4)]
+		client.close()
+
+	assert all(isinstance(t.trade_id, str) for t in trades)
+
+	batch = bars_from_trades(trades + trades[:2], [1])[1]
+	builder = BarBuilder([1])
+	streamed = builder.add_many(trades) + builder.add_many(trades[:2]) + builder.flush()
+	assert batch == streamed
+	assert [(b.open, b.high, b.low, b.close, b.volume, b.trade_count) for b in batch] == [
+		(4000, 4010, 3990, 3990, 16, 3),
+		(4005, 4005, 4005, 4005, 2, 1),
+	]
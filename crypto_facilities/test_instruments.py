@@ -0,0 +1,87 @@
+from hamcrest import *
+from datetime import datetime, timezone
+
+from crypto_facilities import LimitOrderSpec
+from crypto_facilities.instruments import InstrumentIndex, round_to_tick, ROUND_DOWN, ROUND_UP
+
+def make_instrument(symbol, underlying, last_trading_time=None, tick_size=1):
+	i = {
+		'symbol': symbol,
+		'type': 'futures_inverse',
+		'tradeable': True,
+		'underlying': underlying,
+		'tickSize': tick_size,
+		'contractSize': 1,
+	}
+	if last_trading_time is not None:
+		i['lastTradingTime'] = last_trading_time
+	return i
+
+JUN = datetime(2018, 6, 15, 16, tzinfo=timezone.utc)
+SEP = datetime(2018, 9, 28, 16, tzinfo=timezone.utc)
+
+INSTRUMENTS = [
+	make_instrument('fi_xbtusd_180928', 'rr_xbtusd', SEP),
+	make_instrument('pi_xbtusd', 'rr_xbtusd'),
+	make_instrument('fi_xbtusd_180615', 'rr_xbtusd', JUN),
+	make_instrument('fi_xrpusd_180615', 'rr_xrpusd', JUN, tick_size=0.0001),
+]
+
+def test_round_to_tick():
+	assert round_to_tick(4232.4, 1) == 4232
+	assert round_to_tick(0.30004, 0.0001) == 0.3
+	assert round_to_tick(0.30004, 0.0001, ROUND_UP) == 0.3001
+	assert round_to_tick(0.3, 0.0001, ROUND_UP) == 0.3
+	assert round_to_tick(4232.75, 0.5, ROUND_DOWN) == 4232.5
+
+def test_lookups():
+	index = InstrumentIndex(INSTRUMENTS)
+	assert len(index) == 4
+	assert index['pi_xbtusd']['underlying'] == 'rr_xbtusd'
+	assert index.get('fi_ethusd_180615') is None
+	assert_that([i['symbol'] for i in index.with_prefix('fi_xbtusd_')], contains_exactly('fi_xbtusd_180615', 'fi_xbtusd_180928'))
+	assert_that([i['symbol'] for i in index.by_underlying('rr_xbtusd')], contains_exactly('fi_xbtusd_180615', 'fi_xbtusd_180928', 'pi_xbtusd'))
+
+def test_expiry_lookups():
+	index = InstrumentIndex(INSTRUMENTS)
+	assert index.next_expiry('rr_xbtusd', datetime(2018, 1, 1, tzinfo=timezone.utc))['symbol'] == 'fi_xbtusd_180615'
+	assert index.next_expiry('rr_xbtusd', JUN)['symbol'] == 'fi_xbtusd_180928'
+	assert index.next_expiry('rr_xbtusd', SEP) is None
+	assert index.expiring_after('rr_ethusd') == []
+
+def test_tick_conversion():
+	index = InstrumentIndex(INSTRUMENTS)
+	assert index.price_to_ticks('fi_xrpusd_180615', 0.3) == 3000
+	assert index.ticks_to_price('fi_xrpusd_180615', 3001) == 0.3001
+	assert index.round_price('fi_xrpusd_180615', 0.30016) == 0.3002
+	assert index.limit_order_spec('fi_xrpusd_180615', 'buy', 0.30016) == LimitOrderSpec('fi_xrpusd_180615', 'buy', 0.3001)
+	assert index.limit_order_spec('fi_xrpusd_180615', 'sell', 0.30011) == LimitOrderSpec('fi_xrpusd_180615', 'sell', 0.3002)
+
+def test_no_tick_size():
+	index_instrument = {'symbol': 'in_xbtusd', 'type': 'spot index', 'tradeable': False}
+	index = InstrumentIndex(INSTRUMENTS + [index_instrument])
+	for f in (
+		lambda: index.tick_size('in_xbtusd'),
+		lambda: index.price_to_ticks('in_xbtusd', 4000),
+		lambda: index.round_price('in_xbtusd', 4000),
+		lambda: index.limit_order_spec('in_xbtusd', 'buy', 4000),
+	):
+		assert_that(calling(f), raises(ValueError, 'No tickSize for in_xbtusd'))
+
+def test_incremental_refresh():
+	index = InstrumentIndex(INSTRUMENTS)
+	assert index.refresh(INSTRUMENTS) == set()
+
+	dec = make_instrument('fi_xbtusd_181228', 'rr_xbtusd', datetime(2018, 12, 28, 16, tzinfo=timezone.utc))
+	changed = index.refresh([i for i in INSTRUMENTS if i['symbol'] != 'fi_xbtusd_180615'] + [dec])
+	assert changed == {'fi_xbtusd_180615', 'fi_xbtusd_181228'}
+	assert 'fi_xbtusd_180615' not in index
+	assert_that([i['symbol'] for i in index.by_underlying('rr_xbtusd')], contains_exactly('fi_xbtusd_180928', 'fi_xbtusd_181228', 'pi_xbtusd'))
+	assert index.by_underlying('rr_xrpusd') == [INSTRUMENTS[3]]
+	assert index.symbols() == ['fi_xbtusd_180928', 'fi_xbtusd_181228', 'fi_xrpusd_180615', 'pi_xbtusd']
+
+	# Moving an instrument to another underlying updates both views
+	moved = dict(INSTRUMENTS[3], underlying='rr_xbtusd')
+	index.refresh([INSTRUMENTS[0], INSTRUMENTS[1], dec, moved])
+	assert index.by_underlying('rr_xrpusd') == []
+	assert_that([i['symbol'] for i in index.by_underlying('rr_xbtusd')], contains_exactly('fi_xrpusd_180615', 'fi_xbtusd_180928', 'fi_xbtusd_181228', 'pi_xbtusd'))
@@ -0,0 +1,86 @@
+from hamcrest import *
+from datetime import datetime, timezone
+
+import crypto_facilities
+from crypto_facilities.instruments import InstrumentIndex
+from crypto_facilities.risk import RiskEstimator
+
+INSTRUMENTS = [
+	{'symbol': 'fi_xbtusd_180615', 'type': 'futures_inverse', 'tradeable': True, 'underlying': 'rr_xbtusd', 'tickSize': 1, 'contractSize': 1},
+]
+
+ACCOUNTS = {
+	'cash': {'type': 'cashAccount', 'balances': {'xbt': 1.0}},
+	'fi_xbtusd': {
+		'type': 'marginAccount',
+		'currency': 'xbt',
+		'balances': {'fi_xbtusd_180615': 4000, 'xbt': 10.0},
+		'auxiliary': {'af': 9.0, 'pnl': 0.5, 'pv': 10.5},
+		'marginRequirements': {'im': 1.5, 'mm': 1.0, 'lt': 0.8, 'tt': 0.5},
+		'triggerEstimates': {'im': 3110, 'mm': 3000, 'lt': 2890, 'tt': 2830},
+	},
+}
+
+POSITIONS = [
+	{'fillTime': datetime(2018, 1, 1, tzinfo=timezone.utc), 'symbol': 'fi_xbtusd_180615', 'side': 'long', 'size': 4000, 'price': 3800},
+]
+
+def ticker(mark):
+	return [{'symbol': 'fi_xbtusd_180615', 'markPrice': mark}, {'symbol': 'fi_ethusd_180615', 'markPrice': 300}]
+
+def make_estimator(monkeypatch, calls):
+	def get_accounts(key):
+		calls.append('accounts')
+		return ACCOUNTS
+	def get_positions(key):
+		calls.append('positions')
+		return POSITIONS
+	monkeypatch.setattr(crypto_facilities, 'get_accounts', get_accounts)
+	monkeypatch.setattr(crypto_facilities, 'get_positions', get_positions)
+
+	now = [0.0]
+	estimator = RiskEstimator(crypto_facilities.APIKey('public', 'private'), InstrumentIndex(INSTRUMENTS),
+	                          resync_interval=60, drift_threshold=0.01, clock=lambda: now[0])
+	estimator.sync(ticker(4000))
+	return estimator, now
+
+def test_estimates_follow_marks(monkeypatch):
+	estimator, _ = make_estimator(monkeypatch, [])
+	assert estimator.get_accounts() == ACCOUNTS
+
+	estimator.update_tickers(ticker(5000))
+	accounts = estimator.get_accounts()
+	pnl_delta = 4000 * (1 / 4000 - 1 / 5000)
+	assert_that(accounts['fi_xbtusd']['auxiliary'], has_entries({
+		'pnl': close_to(0.5 + pnl_delta, 1e-9),
+		'pv': close_to(10.5 + pnl_delta, 1e-9),
+		# Margin on an inverse contract shrinks as the price rises
+		'af': close_to(9.0 + pnl_delta + 1.5 * 0.2, 1e-9),
+	}))
+	assert_that(accounts['fi_xbtusd']['marginRequirements'], has_entries({
+		'im': close_to(1.2, 1e-9),
+		'mm': close_to(0.8, 1e-9),
+	}))
+	assert accounts['cash'] == ACCOUNTS['cash']
+	# The snapshot itself is left alone
+	assert ACCOUNTS['fi_xbtusd']['auxiliary']['pnl'] == 0.5
+
+def test_resync_cadence_and_drift(monkeypatch):
+	calls = []
+	estimator, now = make_estimator(monkeypatch, calls)
+	assert len(calls) == 2
+
+	# A small move doesn't need the authenticated calls
+	assert not estimator.maybe_resync(ticker(4001))
+	assert len(calls) == 2
+
+	now[0] = 60
+	assert estimator.maybe_resync(ticker(4001))
+	assert len(calls) == 4
+
+	# A large move does, even before the resync interval is up
+	estimator.update_tickers(ticker(4800))
+	assert estimator.drift() > 0.01
+	assert estimator.needs_resync()
+	assert estimator.maybe_resync(ticker(4800))
+	assert estimator.drift() == 0
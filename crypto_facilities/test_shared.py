@@ -0,0 +1,85 @@
+from hamcrest import *
+from datetime import datetime, timezone
+import multiprocessing
+import os
+import subprocess
+import sys
+
+from crypto_facilities import OrderBook
+from crypto_facilities.feed import FeedEvent
+from crypto_facilities.shared import SnapshotPublisher, SnapshotReader
+
+SYMBOLS = ['pi_xbtusd', 'fi_xbtusd_180615']
+
+def shm_name():
+	return 'cf_test_%d' % os.getpid()
+
+def test_order_books():
+	with SnapshotPublisher(shm_name(), SYMBOLS, depth=3, ring_length=2) as publisher, SnapshotReader(shm_name()) as reader:
+		assert reader.symbols == SYMBOLS
+		assert reader.get_order_book('pi_xbtusd') is None
+
+		for i in range(5):
+			publisher.publish_order_book('pi_xbtusd', OrderBook(bids=[[4000 - i, 10], [3999 - i, 5]], asks=[[4001, 1], [4002, 2], [4003, 3], [4004, 4]]))
+		book = reader.get_order_book('pi_xbtusd')
+		assert book == OrderBook(bids=[[3996, 10], [3995, 5]], asks=[[4001, 1], [4002, 2], [4003, 3]])
+		# Sizes are ints, as from get_order_book()
+		assert_that(book.bids[0][1], instance_of(int))
+
+		publisher.publish_order_book('fi_xbtusd_180615', OrderBook(bids=[[4000, 0.5]], asks=[]))
+		assert reader.get_order_book('fi_xbtusd_180615') == OrderBook(bids=[[4000, 0.5]], asks=[])
+		publisher.publish_order_book('fi_xbtusd_180615', OrderBook(bids=[], asks=[]))
+		assert reader.get_order_book('fi_xbtusd_180615') == OrderBook(bids=[], asks=[])
+
+		view = reader.get_order_book_view('pi_xbtusd')
+		assert view.bids.tolist() == [3996, 10, 3995, 5]
+		assert reader.still_valid(view)
+		publisher.publish_order_book('pi_xbtusd', OrderBook(bids=[], asks=[]))
+		assert reader.still_valid(view)
+		# The ring is only two frames long, so this overwrites the frame behind the view
+		publisher.publish_order_book('pi_xbtusd', OrderBook(bids=[], asks=[]))
+		assert not reader.still_valid(view)
+		view.bids.release()
+		view.asks.release()
+
+def test_tickers():
+	with SnapshotPublisher(shm_name(), SYMBOLS) as publisher, SnapshotReader(shm_name()) as reader:
+		last_time = datetime(2016, 2, 25, 10, 56, 10, 364000, tzinfo=timezone.utc)
+		ticker = {'symbol': 'pi_xbtusd', 'suspended': False, 'last': 4232, 'lastTime': last_time, 'bid': 4232.5, 'bidSize': 5000, 'markPrice': 4227}
+		publisher.publish_tickers([ticker, {'symbol': 'fi_ethusd_180615', 'bid': 300}])
+		assert reader.get_tickers() == [ticker]
+		assert_that(reader.get_ticker('pi_xbtusd')['bidSize'], instance_of(int))
+
+		publisher.publish_event(FeedEvent('ticker', 'pi_xbtusd', dict(ticker, bid=4233)))
+		assert reader.get_ticker('pi_xbtusd')['bid'] == 4233
+
+def read_in_child(name, queue):
+	with SnapshotReader(name) as reader:
+		queue.put(reader.get_order_book('pi_xbtusd'))
+
+def test_other_process():
+	with SnapshotPublisher(shm_name(), SYMBOLS) as publisher:
+		publisher.publish_order_book('pi_xbtusd', OrderBook(bids=[[4000, 10]], asks=[[4001, 7]]))
+
+		context = multiprocessing.get_context('spawn')
+		queue = context.Queue()
+		process = context.Process(target=read_in_child, args=(shm_name(), queue))
+		process.start()
+		assert queue.get(timeout=30) == OrderBook(bids=[[4000, 10]], asks=[[4001, 7]])
+		process.join()
+
+def test_reader_leaves_publisher_registered_with_resource_tracker():
+	# Run in a fresh interpreter so that the resource tracker's complaints (which
+	# go to its own stderr) can be seen
+	code = """if True:
+		from crypto_facilities import OrderBook
+		from crypto_facilities.shared import SnapshotPublisher, SnapshotReader
+		with SnapshotPublisher('cf_test_tracker_%d', ['pi_xbtusd']) as publisher:
+			with SnapshotReader(publisher.name) as reader:
+				assert reader.symbols == ['pi_xbtusd']
+	""" % os.getpid()
+	root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	result = subprocess.run([sys.executable, '-c', code], cwd=root, stderr=subprocess.PIPE)
+	assert result.returncode == 0
+	assert b'KeyError' not in result.stderr
+	assert b'leaked' not in result.stderr
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+from setuptools import setup
 
 setup(name='crypto-facilities',
       version='0.1',
@@ -9,4 +9,7 @@ setup(name='crypto-facilities',
       author_email='batterseapower@hotmail.com',
       url='https://github.com/batterseapower/crypto-facilities',
       packages=['crypto_facilities'],
+      entry_points={
+          'console_scripts': ['crypto-facilities=crypto_facilities.cli:main'],
+      },
      )